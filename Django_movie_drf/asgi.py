@@ -13,4 +13,18 @@ from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'Django_movie_drf.settings')
 
-application = get_asgi_application()
+django_application = get_asgi_application()
+
+from Django_movie_drf.yasg import warm_schema  # noqa: E402
+from movie.events import MOVIE_EVENTS_PATH, movie_events  # noqa: E402
+
+warm_schema()
+
+
+async def application(scope, receive, send):
+    """ SSE событий фильма обслуживается напрямую, всё остальное - Django """
+    if scope['type'] == 'http':
+        match = MOVIE_EVENTS_PATH.match(scope['path'])
+        if match:
+            return await movie_events(scope, receive, send, int(match['pk']))
+    return await django_application(scope, receive, send)
@@ -0,0 +1,111 @@
+import mimetypes
+import os
+import re
+from urllib.parse import quote
+
+from django.conf import settings
+from django.core.exceptions import SuspiciousFileOperation
+from django.http import Http404, HttpResponse, StreamingHttpResponse
+from django.utils._os import safe_join
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.http import http_date
+
+from .storage import HASH_LENGTH
+
+RANGE_RE = re.compile(r'^bytes=(\d*)-(\d*)$')
+HASHED_NAME_RE = re.compile(r'\.[0-9a-f]{%d}\.[^./]+$' % HASH_LENGTH)
+CHUNK_SIZE = 64 * 1024
+
+
+def parse_range(header, size):
+    """ (начало, конец) для одного диапазона; None - отдать файл целиком; ValueError - диапазон вне файла """
+    match = RANGE_RE.match(header.strip())
+    if not match or match.groups() == ('', ''):
+        return None
+    start, end = match.groups()
+    if start == '':
+        length = int(end)
+        if length == 0:
+            raise ValueError(header)
+        return max(size - length, 0), size - 1
+    start = int(start)
+    end = min(int(end), size - 1) if end else size - 1
+    if start >= size or start > end:
+        raise ValueError(header)
+    return start, end
+
+
+def read_file(path, start, length):
+    with open(path, 'rb') as f:
+        f.seek(start)
+        while length > 0:
+            chunk = f.read(min(CHUNK_SIZE, length))
+            if not chunk:
+                break
+            length -= len(chunk)
+            yield chunk
+
+
+def serve_media(request, path):
+    """ Отдача MEDIA_ROOT: Range, ETag/Last-Modified и долгий кэш для файлов с хешем в имени
+
+    MEDIA_SERVING = 'x-accel-redirect' или 'x-sendfile' передаёт отдачу файла nginx/Apache,
+    'django' отдаёт файл сам.
+    """
+    try:
+        full_path = safe_join(settings.MEDIA_ROOT, path)
+    except SuspiciousFileOperation:
+        raise Http404
+    if not os.path.isfile(full_path):
+        raise Http404
+    stat = os.stat(full_path)
+    content_type, encoding = mimetypes.guess_type(full_path)
+    content_type = content_type or 'application/octet-stream'
+    etag = '"%x-%x"' % (int(stat.st_mtime), stat.st_size)
+
+    response = get_conditional_response(request, etag=etag, last_modified=int(stat.st_mtime))
+    if response is None:
+        if settings.MEDIA_SERVING == 'x-accel-redirect':
+            response = HttpResponse(content_type=content_type)
+            # Кириллицу в имени Django закодировал бы как =?utf-8?b?...?=, nginx ждёт %-кодировку
+            response['X-Accel-Redirect'] = settings.MEDIA_ACCEL_REDIRECT_PREFIX + quote(path)
+        elif settings.MEDIA_SERVING == 'x-sendfile':
+            response = HttpResponse(content_type=content_type)
+            # Байты пути в файловой системе, mod_xsendfile раскодирует их (XSendFileUnescape)
+            response['X-Sendfile'] = quote(os.fsencode(full_path))
+        else:
+            response = file_response(request, full_path, stat.st_size, content_type, etag)
+        if encoding:
+            response['Content-Encoding'] = encoding
+    response['ETag'] = etag
+    response['Last-Modified'] = http_date(stat.st_mtime)
+    if HASHED_NAME_RE.search(path):
+        patch_cache_control(response, public=True, max_age=settings.MEDIA_IMMUTABLE_MAX_AGE, immutable=True)
+    else:
+        patch_cache_control(response, public=True, max_age=settings.MEDIA_CACHE_MAX_AGE)
+    return response
+
+
+def file_response(request, full_path, size, content_type, etag):
+    start, end = 0, size - 1
+    status = 200
+    range_header = request.META.get('HTTP_RANGE')
+    if_range = request.META.get('HTTP_IF_RANGE')
+    if range_header and size and (if_range is None or if_range == etag):
+        try:
+            byte_range = parse_range(range_header, size)
+        except ValueError:
+            response = HttpResponse(status=416)
+            response['Content-Range'] = f'bytes */{size}'
+            return response
+        if byte_range is not None:
+            start, end = byte_range
+            status = 206
+    response = StreamingHttpResponse(
+        read_file(full_path, start, end - start + 1), status=status, content_type=content_type
+    )
+    response['Content-Length'] = end - start + 1
+    response['Accept-Ranges'] = 'bytes'
+    if status == 206:
+        response['Content-Range'] = f'bytes {start}-{end}/{size}'
+    return response
@@ -9,6 +9,7 @@ https://docs.djangoproject.com/en/4.1/topics/settings/
 For the full list of settings and their values, see
 https://docs.djangoproject.com/en/4.1/ref/settings/
 """
+import os
 from datetime import timedelta
 from pathlib import Path
 
@@ -94,6 +95,23 @@ DATABASES = {
     }
 }
 
+# Общий кэш процессов: версии справочников и фасетов, кэш аутентификации, счётчики throttling.
+# Без REDIS_URL (redis://host:6379/0) - кэш в памяти процесса, только для разработки в один процесс
+REDIS_URL = os.environ.get('REDIS_URL', '')
+if REDIS_URL:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': REDIS_URL,
+        }
+    }
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        }
+    }
+
 # Password validation
 # https://docs.djangoproject.com/en/4.1/ref/settings/#auth-password-validators
 
@@ -132,6 +150,14 @@ STATICFILES_DIRS = [STATIC_DIR]
 
 MEDIA_URL = 'media/'
 MEDIA_ROOT = BASE_DIR / 'media'
+# Имена загруженных файлов с хешем содержимого
+DEFAULT_FILE_STORAGE = 'Django_movie_drf.storage.ContentHashedStorage'
+# Отдача медиа: 'django', 'x-accel-redirect' (nginx) или 'x-sendfile' (Apache)
+MEDIA_SERVING = os.environ.get('MEDIA_SERVING', 'django')
+# internal location nginx, указывающий на MEDIA_ROOT
+MEDIA_ACCEL_REDIRECT_PREFIX = '/protected-media/'
+MEDIA_CACHE_MAX_AGE = 3600
+MEDIA_IMMUTABLE_MAX_AGE = 31536000
 # Default primary key field type
 # https://docs.djangoproject.com/en/4.1/ref/settings/#default-auto-field
 
@@ -211,14 +237,24 @@ CKEDITOR_CONFIGS = {
 
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': (
-        'rest_framework.authentication.TokenAuthentication',
-        'rest_framework_simplejwt.authentication.JWTAuthentication',
+        'movie.authentication.CachedTokenAuthentication',
+        'movie.authentication.CachedJWTAuthentication',
     ),
     'DEFAULT_FILTER_BACKENDS': (
         'django_filters.rest_framework.DjangoFilterBackend',
     ),
     'DEFAULT_PAGINATION_CLASS': 'rest_framework.pagination.LimitOffsetPagination',
-    'PAGE_SIZE': 2
+    'PAGE_SIZE': 2,
+    'DEFAULT_THROTTLE_CLASSES': (
+        'movie.throttling.IPTokenBucketThrottle',
+        'movie.throttling.UserTokenBucketThrottle',
+    ),
+    'DEFAULT_THROTTLE_RATES': {
+        'review_ip': '10/min',
+        'review_user': '30/min',
+        'rating_ip': '30/min',
+        'rating_user': '60/min',
+    },
 }
 # smtp
 # EMAIL_USE_TLS = True
@@ -235,6 +271,84 @@ DJOSER = {
     'SERIALIZERS': {},
 }
 
+# Кэш аутентификации: локальный (в процессе) и общий (CACHES)
+AUTH_CACHE_LOCAL_TTL = 5
+AUTH_CACHE_LOCAL_MAXSIZE = 10000
+AUTH_CACHE_SHARED_TTL = 300
+# Поля пользователя в кэше; остальные (в том числе пароль) загружаются из БД только при обращении
+AUTH_CACHE_USER_FIELDS = ('id', 'username', 'email', 'first_name', 'last_name', 'is_active', 'is_staff', 'is_superuser')
+
+# Фасеты фильтра фильмов
+FACETS_CACHE_TTL = 600
+FACETS_YEAR_BUCKET = 10
+
+# Как часто процесс сверяет версию справочников (Genre, Category, RatingStar), в секундах
+REFERENCE_DATA_CHECK_INTERVAL = 1
+# Справочники перечитываются не реже, даже если версия в кэше потерялась или не менялась
+REFERENCE_DATA_MAX_AGE = 300
+
+# Ключ HMAC для хеширования IP голосующих; при смене старые голоса не узнаются
+VOTER_KEY_SECRET = os.environ.get('VOTER_KEY_SECRET', SECRET_KEY)
+
+# Прокси, которым доверяем X-Forwarded-For (адреса или сети)
+TRUSTED_PROXIES = ['127.0.0.1/32', '::1/128']
+
+# Сколько ведер throttling держать в памяти процесса
+THROTTLE_MAX_BUCKETS = 100000
+# Длина префикса, по которому лимитируются клиенты IPv6
+THROTTLE_IPV6_PREFIX = 64
+
+# Языки, для которых хранятся готовые документы детальной страницы фильма
+MOVIE_DOCUMENT_LANGUAGES = [LANGUAGE_CODE]
+
+# Прогрев кэшей (python manage.py warm_cache и публикация фильмов в админке):
+# документы фильмов и фасеты прогреваются напрямую, без HTTP
+WARMUP_LANGUAGES = MOVIE_DOCUMENT_LANGUAGES
+WARMUP_TOP_MOVIES = 50
+# Дополнительные URL для запроса по HTTP командой warm_cache; только если задан WARMUP_BASE_URL
+WARMUP_BASE_URL = os.environ.get('WARMUP_BASE_URL', '')
+WARMUP_URLS = []
+WARMUP_CONCURRENCY = 4
+WARMUP_TIMEOUT = 30
+
+# SSE событий фильма (/api/v1/movie/<pk>/events/, только под ASGI)
+MOVIE_EVENTS_BROKER = 'movie.events.LocalBroker'
+MOVIE_EVENTS_INTERVAL = 1
+MOVIE_EVENTS_HEARTBEAT = 15
+MOVIE_EVENTS_QUEUE_SIZE = 2
+MOVIE_EVENTS_MAX_REVIEWS = 20
+
+# Голоса старше этого срока сворачиваются в RatingRollup (python manage.py rollup_ratings)
+RATING_RETENTION_DAYS = 90
+# Ещё столько дней после свёртки повторный голос заменяет свёрнутый, потом свёрнутый голос окончательный
+RATING_REVOTE_WINDOW_DAYS = 30
+# Число секций HASH(movie_id) для Rating на PostgreSQL (python manage.py partition_ratings)
+RATING_PARTITIONS = 16
+
+# Длина текстовой выдержки из описания фильма
+MOVIE_EXCERPT_LENGTH = 300
+
+# Сброс нагрузки (movie/limits.py): одновременных запросов вьюх в процессе,
+# предельное ожидание в очереди в секундах (вместе с X-Request-Start от прокси) и Retry-After для 503
+LOAD_SHEDDING_MAX_IN_FLIGHT = int(os.environ.get('LOAD_SHEDDING_MAX_IN_FLIGHT', 32))
+LOAD_SHEDDING_MAX_QUEUE_TIME = 0.5
+LOAD_SHEDDING_RETRY_AFTER = 5
+# Отдавать только кэшированные списки и страницы фильмов, не обращаясь к БД
+DEGRADED_MODE = os.environ.get('DEGRADED_MODE') == '1'
+DEGRADED_CACHE_TTL = 3600
+# Последний успешный ответ перезаписывается в кэше не чаще, чем раз в столько секунд
+DEGRADED_SNAPSHOT_MAX_AGE = 60
+
+# Максимум элементов в пакетной записи отзывов и оценок (review/batch/, rating/batch/);
+# каждый элемент расходует токен лимита review/rating, пакет больше ведра лимита клиента отклоняется с 400
+BATCH_MAX_SIZE = 100
+
+# Версия кода (хеш коммита или номер релиза), задаётся при деплое
+CODE_VERSION = os.environ.get('CODE_VERSION', 'dev')
+
+# Заранее сгенерированная схема OpenAPI (python manage.py generate_schema)
+OPENAPI_SCHEMA_DIR = BASE_DIR / 'schema'
+
 SIMPLE_JWT = {
     'ACCESS_TOKEN_LIFETIME': timedelta(minutes=5),
     'REFRESH_TOKEN_LIFETIME': timedelta(days=1),
@@ -0,0 +1,24 @@
+import hashlib
+import os
+
+from django.core.files.storage import FileSystemStorage
+
+HASH_LENGTH = 12
+
+
+class ContentHashedStorage(FileSystemStorage):
+    """ Хеш содержимого в имени загруженного файла: такие файлы можно кэшировать навсегда """
+
+    def save(self, name, content, max_length=None):
+        if name is None:
+            name = content.name
+        digest = hashlib.md5()
+        for chunk in content.chunks():
+            digest.update(chunk)
+        content.seek(0)
+        root, ext = os.path.splitext(name)
+        name = f'{root}.{digest.hexdigest()[:HASH_LENGTH]}{ext}'
+        if self.exists(name):
+            # Тот же файл уже загружен
+            return name
+        return super().save(name, content, max_length)
@@ -14,3 +14,7 @@ from django.core.wsgi import get_wsgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'Django_movie_drf.settings')
 
 application = get_wsgi_application()
+
+from Django_movie_drf.yasg import warm_schema  # noqa: E402
+
+warm_schema()
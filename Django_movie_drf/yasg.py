@@ -1,22 +1,132 @@
+import hashlib
+import logging
+import os
+
+from django.conf import settings
+from django.http import HttpResponse
 from django.urls import path
+from django.utils.cache import get_conditional_response, patch_cache_control, patch_vary_headers
+from django.utils.text import compress_string
 from rest_framework import permissions
+from drf_yasg.codecs import OpenAPICodecJson, yaml_sane_dump, yaml_sane_load
+from drf_yasg.generators import OpenAPISchemaGenerator
+from drf_yasg.renderers import OpenAPIRenderer, SwaggerJSONRenderer, SwaggerYAMLRenderer
 from drf_yasg.views import get_schema_view
 from drf_yasg import openapi
 
+logger = logging.getLogger(__name__)
+
+api_info = openapi.Info(
+   title="Django Movie",
+   default_version='v1',
+   description="Test description",
+   license=openapi.License(name="BSD License"),
+)
 
 schema_view = get_schema_view(
-   openapi.Info(
-      title="Django Movie",
-      default_version='v1',
-      description="Test description",
-      license=openapi.License(name="BSD License"),
-   ),
+   api_info,
    public=True,
    permission_classes=(permissions.AllowAny,),
 )
 
+# Схема в памяти процесса: {формат: (тело, gzip-тело, etag)}
+_schema_cache = {}
+
+
+def get_schema_file():
+   """ Файл схемы для текущей версии кода """
+   return os.path.join(settings.OPENAPI_SCHEMA_DIR, f'openapi-{settings.CODE_VERSION}.json')
+
+
+def generate_schema():
+   """ Генерация схемы OpenAPI (дорогая интроспекция всех viewset и сериализаторов) """
+   generator = OpenAPISchemaGenerator(api_info, api_info._default_version)
+   schema = generator.get_schema(request=None, public=True)
+   return OpenAPICodecJson([]).encode(schema)
+
+
+def write_schema():
+   """ Сгенерировать схему и атомарно записать её в файл, удалив файлы старых версий """
+   schema_file = get_schema_file()
+   os.makedirs(settings.OPENAPI_SCHEMA_DIR, exist_ok=True)
+   content = generate_schema()
+   tmp_file = f'{schema_file}.{os.getpid()}.tmp'
+   with open(tmp_file, 'wb') as f:
+      f.write(content)
+   os.replace(tmp_file, schema_file)
+   for name in os.listdir(settings.OPENAPI_SCHEMA_DIR):
+      old_file = os.path.join(settings.OPENAPI_SCHEMA_DIR, name)
+      if name.startswith('openapi-') and name.endswith('.json') and old_file != schema_file:
+         os.remove(old_file)
+   _schema_cache.clear()
+   return schema_file
+
+
+def read_schema():
+   """ Содержимое файла схемы; если файл не записать (каталог только для чтения) - схема в памяти """
+   schema_file = get_schema_file()
+   if not os.path.exists(schema_file):
+      try:
+         write_schema()
+      except OSError:
+         logger.warning('Не удалось записать схему OpenAPI в %s, она сгенерирована в памяти', schema_file)
+   if not os.path.exists(schema_file):
+      return generate_schema()
+   with open(schema_file, 'rb') as f:
+      return f.read()
+
+
+def load_schema(fmt='json'):
+   """ Схема из памяти или из файла; генерируется, только если файла для этой версии кода нет """
+   if fmt not in _schema_cache:
+      content = read_schema()
+      if fmt == 'yaml':
+         content = yaml_sane_dump(yaml_sane_load(content), binary=True)
+      etag = '"%s"' % hashlib.md5(content).hexdigest()
+      _schema_cache[fmt] = (content, compress_string(content), etag)
+   return _schema_cache[fmt]
+
+
+def warm_schema():
+   """ Прогрев при старте воркера: схема загружается в память до первого запроса к документации """
+   try:
+      load_schema()
+   except OSError:
+      # Документация не должна мешать запуску: схема будет загружена при первом запросе
+      logger.exception('Не удалось загрузить схему OpenAPI')
+
+
+def schema_response(request, fmt, content_type):
+   """ Отдать готовую схему с ETag и gzip """
+   content, gzipped, etag = load_schema(fmt)
+   response = get_conditional_response(request, etag=etag)
+   if response is None:
+      if 'gzip' in request.META.get('HTTP_ACCEPT_ENCODING', ''):
+         response = HttpResponse(gzipped, content_type=content_type)
+         response['Content-Encoding'] = 'gzip'
+      else:
+         response = HttpResponse(content, content_type=content_type)
+   response['ETag'] = etag
+   patch_vary_headers(response, ('Accept-Encoding',))
+   patch_cache_control(response, public=True, max_age=0)
+   return response
+
+
+class CachedSchemaView(schema_view):
+   """ Отдаёт схему из файла вместо генерации на каждый запрос """
+
+   def get(self, request, version='', format=None):
+      renderer = request.accepted_renderer
+      if isinstance(renderer, SwaggerYAMLRenderer):
+         return schema_response(request, 'yaml', 'application/yaml; charset=utf-8')
+      if isinstance(renderer, (SwaggerJSONRenderer, OpenAPIRenderer)):
+         return schema_response(request, 'json', f'{renderer.media_type}; charset=utf-8')
+      # UI-страницы генерируют схему без эндпоинтов, а саму схему запрашивают через ?format=openapi
+      return super().get(request, version, format)
+
+
 urlpatterns = [
-   path('swagger(?P<format>\.json|\.yaml)', schema_view.without_ui(cache_timeout=0), name='schema-json'),
-   path('swagger/', schema_view.with_ui('swagger', cache_timeout=0), name='schema-swagger-ui'),
-   path('redoc/', schema_view.with_ui('redoc', cache_timeout=0), name='schema-redoc'),
-]
\ No newline at end of file
+   path('swagger(?P<format>\.json|\.yaml)', CachedSchemaView.without_ui(cache_timeout=0), name='schema-json'),
+   path('swagger/', CachedSchemaView.with_ui('swagger', cache_timeout=0), name='schema-swagger-ui'),
+   path('redoc/', CachedSchemaView.with_ui('redoc', cache_timeout=0), name='schema-redoc'),
+]
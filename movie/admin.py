@@ -2,6 +2,9 @@ from django.contrib import admin
 from django.utils.safestring import mark_safe
 
 from .models import Category, Genre, Actor, Movie, RatingStar, Rating, Review, MovieShots
+from .documents import invalidate_movie_documents
+from .service import bump_facets_version, defer_descriptions
+from .warmup import warm_up_published
 
 
 @admin.register(Genre)
@@ -71,6 +74,12 @@ class MovieAdmin(admin.ModelAdmin):
         }),
     )
 
+    def get_queryset(self, request):
+        queryset = super().get_queryset(request)
+        if request.resolver_match and request.resolver_match.url_name.endswith('_changelist'):
+            queryset = defer_descriptions(queryset)
+        return queryset
+
     def get_photo(self, obj):
         return mark_safe(f'<img src="{obj.poster.url}" width="110">')
 
@@ -78,7 +87,10 @@ class MovieAdmin(admin.ModelAdmin):
 
     def unpublished(self, request, queryset):
         """ Снять с публикации """
+        movie_ids = list(queryset.values_list('pk', flat=True))
         row_update = queryset.update(draft=True)
+        bump_facets_version()
+        invalidate_movie_documents(movie_ids)
         if row_update == 1:
             message_bit = "1 записей была обновлена"
         else:
@@ -87,7 +99,10 @@ class MovieAdmin(admin.ModelAdmin):
 
     def publish(self, request, queryset):
         """ Снять с публикации """
+        movie_ids = list(queryset.values_list('pk', flat=True))
         row_update = queryset.update(draft=False)
+        bump_facets_version()
+        warm_up_published(movie_ids)
         if row_update == 1:
             message_bit = "1 записей была обновлена"
         else:
@@ -116,7 +131,7 @@ class ReviewsAdmin(admin.ModelAdmin):
 
 @admin.register(Rating)
 class RatingAdmin(admin.ModelAdmin):
-    list_display = ('star', 'movie', 'ip')
+    list_display = ('star', 'movie', 'voter')
 
 
 @admin.register(MovieShots)
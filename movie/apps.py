@@ -6,3 +6,6 @@ class MovieConfig(AppConfig):
     name = 'movie'
 
     verbose_name = 'Фильмы'
+
+    def ready(self):
+        from . import signals  # noqa: F401
@@ -0,0 +1,98 @@
+import hashlib
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.db import router
+from rest_framework.authentication import TokenAuthentication
+from rest_framework.authtoken.models import Token
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.settings import api_settings as jwt_settings
+
+from . import metrics
+from .cache import LocalCache
+
+# Локальный кэш живёт недолго: другие процессы узнают об инвалидации только через общий кэш
+local_cache = LocalCache(maxsize=settings.AUTH_CACHE_LOCAL_MAXSIZE, ttl=settings.AUTH_CACHE_LOCAL_TTL)
+
+
+def token_cache_key(key):
+    return 'auth:token:' + hashlib.sha256(key.encode()).hexdigest()
+
+
+def user_cache_key(user_id):
+    return f'auth:user:{user_id}'
+
+
+def cached_lookup(cache_key, load):
+    """ Локальный кэш -> общий кэш -> БД """
+    value = local_cache.get(cache_key)
+    if value is not None:
+        metrics.incr('auth.local_hits')
+        return value
+    value = cache.get(cache_key)
+    if value is not None:
+        metrics.incr('auth.shared_hits')
+    else:
+        metrics.incr('auth.db_lookups')
+        value = load()
+        cache.set(cache_key, value, settings.AUTH_CACHE_SHARED_TTL)
+    local_cache.set(cache_key, value)
+    return value
+
+
+def dump_instance(instance, fields):
+    return {name: getattr(instance, name) for name in fields}
+
+
+def load_instance(model, data):
+    """ Экземпляр из кэша: остальные поля отложены (deferred), save() запишет только загруженные """
+    field_names = [field.attname for field in model._meta.concrete_fields if field.attname in data]
+    return model.from_db(router.db_for_read(model), field_names, [data[name] for name in field_names])
+
+
+def dump_user(user):
+    # Только поля для API и проверок прав: хеш пароля в общий кэш не попадает
+    return dump_instance(user, settings.AUTH_CACHE_USER_FIELDS)
+
+
+def invalidate_token(key):
+    cache_key = token_cache_key(key)
+    local_cache.delete(cache_key)
+    cache.delete(cache_key)
+
+
+def invalidate_user(user_id):
+    """ Сбросить пользователя и все его токены """
+    cache_key = user_cache_key(user_id)
+    local_cache.delete(cache_key)
+    cache.delete(cache_key)
+    for key in Token.objects.filter(user_id=user_id).values_list('key', flat=True):
+        invalidate_token(key)
+
+
+class CachedTokenAuthentication(TokenAuthentication):
+    """ TokenAuthentication без обращения к БД на каждый запрос """
+
+    def authenticate_credentials(self, key):
+        def load():
+            user, token = super(CachedTokenAuthentication, self).authenticate_credentials(key)
+            return dump_user(user), dump_instance(token, ('key', 'user_id', 'created'))
+
+        user_data, token_data = cached_lookup(token_cache_key(key), load)
+        user = load_instance(get_user_model(), user_data)
+        token = load_instance(self.get_model(), token_data)
+        token.user = user
+        return user, token
+
+
+class CachedJWTAuthentication(JWTAuthentication):
+    """ JWTAuthentication без загрузки пользователя из БД на каждый запрос """
+
+    def get_user(self, validated_token):
+        user_id = validated_token.get(jwt_settings.USER_ID_CLAIM)
+        if user_id is None:
+            return super().get_user(validated_token)
+        user_data = cached_lookup(user_cache_key(user_id), lambda: dump_user(super(
+            CachedJWTAuthentication, self).get_user(validated_token)))
+        return load_instance(get_user_model(), user_data)
@@ -0,0 +1,105 @@
+import json
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.db import connection
+from django.db.models import prefetch_related_objects
+from django.utils import translation
+from rest_framework.utils.encoders import JSONEncoder
+
+from .models import Movie, MovieDocument
+from .serializers import MovieDetailSerializer
+
+
+def get_languages():
+    return list(settings.MOVIE_DOCUMENT_LANGUAGES)
+
+
+def render_movie_document(movie, language):
+    """ Ответ детальной страницы фильма в виде обычного JSON """
+    with translation.override(language):
+        data = MovieDetailSerializer(movie).data
+    return json.loads(json.dumps(data, cls=JSONEncoder))
+
+
+def prefetch_review_trees(movies):
+    """ Отзывы фильмов с ответами любой вложенности одним запросом вместо запроса на каждый отзыв """
+    prefetch_related_objects(movies, 'reviews')
+    reviews = [review for movie in movies for review in movie.reviews.all()]
+    children = defaultdict(list)
+    for review in reviews:
+        children[review.parent_id].append(review)
+    for review in reviews:
+        # То же, что делает prefetch_related для review.children
+        queryset = review.children.all()
+        queryset._result_cache = children[review.pk]
+        queryset._prefetch_done = True
+        review._prefetched_objects_cache = {'children': queryset}
+
+
+def save_movie_documents(movies, language):
+    movies = list(movies)
+    prefetch_related_objects(movies, 'actors', 'directors', 'genres')
+    prefetch_review_trees(movies)
+    documents = [
+        MovieDocument(movie=movie, language=language, document=render_movie_document(movie, language))
+        for movie in movies
+    ]
+    MovieDocument.objects.bulk_create(
+        documents, update_conflicts=True, unique_fields=['movie', 'language'], update_fields=['document', 'updated']
+    )
+    return documents
+
+
+def get_movie_document(pk, language=None):
+    """ Документ фильма одним запросом по индексу; при промахе собирается и сохраняется """
+    language = language or translation.get_language()
+    if language not in get_languages():
+        movie = Movie.objects.filter(draft=False, pk=pk).first()
+        return render_movie_document(movie, language) if movie else None
+    document = MovieDocument.objects.filter(movie_id=pk, language=language).values_list('document', flat=True).first()
+    if document is None:
+        movie = Movie.objects.filter(draft=False, pk=pk).first()
+        if movie is None:
+            return None
+        document = save_movie_documents([movie], language)[0].document
+    return document
+
+
+def absolute_media_urls(document, request):
+    """ Документ хранит пути к файлам без хоста; в ответе они абсолютные, как в остальных эндпоинтах """
+
+    def absolute(url):
+        return request.build_absolute_uri(url) if url else url
+
+    document = {**document, 'poster': absolute(document.get('poster'))}
+    for key in ('actors', 'directors'):
+        document[key] = [{**person, 'image': absolute(person.get('image'))} for person in document.get(key, [])]
+    return document
+
+
+def invalidate_movie_documents(movie_ids):
+    """ Документы устарели: пересоберутся при следующем запросе или командой rebuild_movie_documents """
+    MovieDocument.objects.filter(movie_id__in=movie_ids).delete()
+
+
+def _rebuild_batch(movie_ids, language):
+    try:
+        return len(save_movie_documents(Movie.objects.filter(pk__in=movie_ids, draft=False), language))
+    finally:
+        connection.close()
+
+
+def rebuild_movie_documents(movie_ids=None, workers=4, batch_size=100):
+    """ Пересобрать документы пачками в пуле потоков; возвращает количество документов """
+    if movie_ids is None:
+        movie_ids = Movie.objects.filter(draft=False).order_by('pk').values_list('pk', flat=True)
+    movie_ids = list(movie_ids)
+    MovieDocument.objects.filter(movie__draft=True).delete()
+    jobs = [
+        (movie_ids[i:i + batch_size], language)
+        for language in get_languages() for i in range(0, len(movie_ids), batch_size)
+    ]
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        return sum(pool.map(lambda job: _rebuild_batch(*job), jobs))
@@ -0,0 +1,191 @@
+import asyncio
+import json
+import logging
+import re
+
+from asgiref.sync import sync_to_async
+from corsheaders.conf import conf as cors_conf
+from django.conf import settings
+from django.utils.module_loading import import_string
+
+from . import metrics
+from .models import Movie
+from .service import get_movie_ratings
+
+logger = logging.getLogger(__name__)
+
+MOVIE_EVENTS_PATH = re.compile(r'^/api/v1/movie/(?P<pk>\d+)/events/$')
+
+
+class LocalBroker:
+    """ Pub/sub в памяти процесса для подписчиков на события фильма
+
+    publish() можно вызывать из любого потока (сигналы Django). События не
+    рассылаются сразу: за интервал MOVIE_EVENTS_INTERVAL они копятся по фильму
+    и уходят одной дельтой с актуальным рейтингом и новыми отзывами.
+    """
+
+    def __init__(self):
+        self._loop = None
+        self._subscribers = {}
+        self._dirty = {}
+        self._flusher = None
+
+    def subscribe(self, movie_id):
+        if self._loop is None:
+            self._loop = asyncio.get_running_loop()
+        if self._flusher is None or self._flusher.done():
+            self._flusher = self._loop.create_task(self._flush_forever())
+        queue = asyncio.Queue(maxsize=settings.MOVIE_EVENTS_QUEUE_SIZE)
+        self._subscribers.setdefault(movie_id, set()).add(queue)
+        metrics.incr('events.subscribers')
+        return queue
+
+    def unsubscribe(self, movie_id, queue):
+        queues = self._subscribers.get(movie_id)
+        if queues is not None:
+            queues.discard(queue)
+            if not queues:
+                del self._subscribers[movie_id]
+        metrics.incr('events.subscribers', -1)
+
+    def publish(self, movie_id, kind, payload=None):
+        """ kind: 'rating' (изменился рейтинг) или 'review' (новый отзыв, payload - сам отзыв) """
+        if self._loop is None or movie_id not in self._subscribers:
+            return
+        self._loop.call_soon_threadsafe(self._mark, movie_id, kind, payload)
+
+    def _mark(self, movie_id, kind, payload):
+        dirty = self._dirty.setdefault(movie_id, {'rating': False, 'reviews': []})
+        if kind == 'rating':
+            dirty['rating'] = True
+        elif len(dirty['reviews']) < settings.MOVIE_EVENTS_MAX_REVIEWS:
+            dirty['reviews'].append(payload)
+
+    async def _flush_forever(self):
+        while True:
+            await asyncio.sleep(settings.MOVIE_EVENTS_INTERVAL)
+            if self._dirty:
+                dirty, self._dirty = self._dirty, {}
+                try:
+                    await self.flush(dirty)
+                except Exception:
+                    logger.exception('Не удалось разослать события фильмов')
+
+    async def flush(self, dirty):
+        rated = [movie_id for movie_id, changes in dirty.items() if changes['rating']]
+        ratings = await sync_to_async(get_movie_ratings)(rated) if rated else {}
+        for movie_id, changes in dirty.items():
+            event = {'movie': movie_id}
+            if changes['rating']:
+                event['rating'] = ratings.get(movie_id, {'votes': 0, 'average': None})
+            if changes['reviews']:
+                event['reviews'] = changes['reviews']
+            for queue in self._subscribers.get(movie_id, ()):
+                if queue.full():
+                    # Медленный клиент: старая дельта не нужна, если есть новая
+                    queue.get_nowait()
+                queue.put_nowait(event)
+            metrics.incr('events.deltas')
+
+
+def publish_ratings(movie_ids):
+    """ Рейтинг фильмов изменился: одно событие на фильм, сколько бы оценок ни пришло """
+    broker = get_broker()
+    for movie_id in set(movie_ids):
+        broker.publish(movie_id, 'rating')
+
+
+def publish_reviews(reviews):
+    broker = get_broker()
+    for review in reviews:
+        broker.publish(review.movie_id, 'review', {
+            'id': review.pk, 'name': review.name, 'text': review.text, 'parent': review.parent_id,
+        })
+
+
+_broker = None
+
+
+def get_broker():
+    global _broker
+    if _broker is None:
+        _broker = import_string(settings.MOVIE_EVENTS_BROKER)()
+    return _broker
+
+
+def get_cors_headers(scope):
+    """ CORS-заголовки по настройкам corsheaders: обработчик работает в обход middleware Django """
+    origin = dict(scope['headers']).get(b'origin', b'').decode('latin-1')
+    if not origin or not re.match(cors_conf.CORS_URLS_REGEX, scope['path']):
+        return []
+    headers = [(b'vary', b'origin')]
+    if cors_conf.CORS_ALLOW_ALL_ORIGINS and not cors_conf.CORS_ALLOW_CREDENTIALS:
+        return headers + [(b'access-control-allow-origin', b'*')]
+    allowed = origin in cors_conf.CORS_ALLOWED_ORIGINS or cors_conf.CORS_ALLOW_ALL_ORIGINS or any(
+        re.match(pattern, origin) for pattern in cors_conf.CORS_ALLOWED_ORIGIN_REGEXES
+    )
+    if not allowed:
+        return headers
+    headers.append((b'access-control-allow-origin', origin.encode('latin-1')))
+    if cors_conf.CORS_ALLOW_CREDENTIALS:
+        headers.append((b'access-control-allow-credentials', b'true'))
+    return headers
+
+
+async def send_error(send, status, text, headers=()):
+    await send({
+        'type': 'http.response.start', 'status': status,
+        'headers': [(b'content-type', b'text/plain'), *headers],
+    })
+    await send({'type': 'http.response.body', 'body': text})
+
+
+async def movie_events(scope, receive, send, movie_id):
+    """ ASGI-обработчик SSE: /api/v1/movie/<pk>/events/ """
+    cors_headers = get_cors_headers(scope)
+    if scope['method'] != 'GET':
+        await send_error(send, 405, b'Method Not Allowed', [(b'allow', b'GET'), *cors_headers])
+        return
+    if not await sync_to_async(Movie.objects.filter(pk=movie_id, draft=False).exists)():
+        await send_error(send, 404, b'Not Found', cors_headers)
+        return
+
+    async def wait_disconnect():
+        while (await receive())['type'] != 'http.disconnect':
+            pass
+
+    broker = get_broker()
+    queue = broker.subscribe(movie_id)
+    disconnected = asyncio.ensure_future(wait_disconnect())
+    getter = None
+    try:
+        await send({
+            'type': 'http.response.start',
+            'status': 200,
+            'headers': [
+                (b'content-type', b'text/event-stream'),
+                (b'cache-control', b'no-cache'),
+                (b'x-accel-buffering', b'no'),
+                *cors_headers,
+            ],
+        })
+        await send({'type': 'http.response.body', 'body': b': connected\n\n', 'more_body': True})
+        while True:
+            getter = getter or asyncio.ensure_future(queue.get())
+            done, _ = await asyncio.wait(
+                {getter, disconnected}, timeout=settings.MOVIE_EVENTS_HEARTBEAT, return_when=asyncio.FIRST_COMPLETED
+            )
+            if disconnected in done:
+                break
+            if getter in done:
+                event, getter = getter.result(), None
+                chunk = f'event: update\ndata: {json.dumps(event, ensure_ascii=False)}\n\n'.encode()
+            else:
+                chunk = b': ping\n\n'
+            await send({'type': 'http.response.body', 'body': chunk, 'more_body': True})
+    finally:
+        disconnected.cancel()
+        if getter is not None:
+            getter.cancel()
+        broker.unsubscribe(movie_id, queue)
@@ -0,0 +1,194 @@
+import logging
+import threading
+import time
+from contextlib import contextmanager
+from urllib.parse import urlencode
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import DatabaseError, OperationalError, connection
+from django.utils.translation import get_language
+from rest_framework.exceptions import APIException
+from rest_framework.response import Response
+
+from . import metrics
+from .service import is_trusted_proxy
+
+logger = logging.getLogger(__name__)
+
+
+class Overloaded(APIException):
+    """ 503 с Retry-After """
+    status_code = 503
+    default_detail = 'Сервис перегружен, повторите запрос позже.'
+    default_code = 'overloaded'
+
+    def __init__(self, detail=None, code=None):
+        super().__init__(detail, code)
+        self.wait = settings.LOAD_SHEDDING_RETRY_AFTER
+
+
+class QueryBudgetExceeded(Exception):
+    pass
+
+
+class ConcurrencyLimiter:
+    """ Не больше LOAD_SHEDDING_MAX_IN_FLIGHT запросов вьюх одновременно в процессе
+
+    Остальные ждут свободного места, пока время в очереди (вместе с ожиданием до Django
+    по X-Request-Start) не превысит LOAD_SHEDDING_MAX_QUEUE_TIME, после чего сбрасываются.
+    """
+
+    def __init__(self):
+        self._condition = threading.Condition()
+        self.in_flight = 0
+        self.waiting = 0
+
+    def acquire(self, queue_time=0.0):
+        """ True - место получено, False - запрос нужно сбросить """
+        timeout = settings.LOAD_SHEDDING_MAX_QUEUE_TIME - queue_time
+        if timeout <= 0:
+            metrics.incr('limiter.shed_queue_time')
+            return False
+        with self._condition:
+            self.waiting += 1
+            try:
+                acquired = self._condition.wait_for(
+                    lambda: self.in_flight < settings.LOAD_SHEDDING_MAX_IN_FLIGHT, timeout
+                )
+            finally:
+                self.waiting -= 1
+            if acquired:
+                self.in_flight += 1
+        metrics.incr('limiter.admitted' if acquired else 'limiter.shed_in_flight')
+        return acquired
+
+    def release(self):
+        with self._condition:
+            self.in_flight -= 1
+            self._condition.notify()
+
+
+limiter = ConcurrencyLimiter()
+metrics.gauge('limiter.in_flight', lambda: limiter.in_flight)
+metrics.gauge('limiter.waiting', lambda: limiter.waiting)
+metrics.gauge('limiter.max_in_flight', lambda: settings.LOAD_SHEDDING_MAX_IN_FLIGHT)
+metrics.gauge('limiter.degraded_mode', lambda: settings.DEGRADED_MODE)
+
+
+def get_queue_time(request):
+    """ Сколько запрос ждал до Django: X-Request-Start от доверенного прокси (nginx: "t=${msec}") """
+    header = request.META.get('HTTP_X_REQUEST_START')
+    if not header or not is_trusted_proxy(request.META.get('REMOTE_ADDR')):
+        return 0.0
+    try:
+        started = float(header.strip().removeprefix('t='))
+    except ValueError:
+        return 0.0
+    # Миллисекунды и микросекунды
+    while started > 1e11:
+        started /= 1000
+    return max(0.0, time.time() - started)
+
+
+class QueryGuard:
+    """ Бюджет запросов к БД и statement_timeout (PostgreSQL) на время обработки запроса вьюхи """
+
+    def __init__(self, name, budget=None, timeout=None):
+        self.name = name
+        self.budget = budget
+        self.timeout = timeout if connection.vendor == 'postgresql' else None
+        self.timeout_set = False
+        self.count = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        self.count += 1
+        if self.budget is not None and self.count > self.budget:
+            metrics.incr(f'budget.{self.name}.exceeded')
+            raise QueryBudgetExceeded(f'больше {self.budget} запросов к БД')
+        if self.timeout and not self.timeout_set:
+            # Только перед первым запросом: ответы из кэша не трогают БД
+            self.timeout_set = True
+            execute('SET statement_timeout = %s', [int(self.timeout)], False, context)
+        return execute(sql, params, many, context)
+
+
+@contextmanager
+def query_guard(name, budget=None, timeout=None):
+    guard = QueryGuard(name, budget, timeout)
+    try:
+        with connection.execute_wrapper(guard):
+            yield guard
+    finally:
+        if guard.timeout_set:
+            try:
+                with connection.cursor() as cursor:
+                    cursor.execute('RESET statement_timeout')
+            except DatabaseError:
+                # Таймаут не должен достаться следующему запросу на этом соединении
+                connection.close()
+
+
+class LoadSheddingMixin:
+    """ Ограничение конкурентности, statement_timeout и бюджет запросов к БД для вьюсета
+
+    При перегрузке, таймауте, превышении бюджета или ошибке БД GET-запросы действий из
+    degraded_actions получают последний успешный ответ из кэша с заголовком X-Degraded,
+    остальные - 503 с Retry-After. DEGRADED_MODE = True отдаёт только кэш, без БД.
+    """
+    # Миллисекунды; None - без ограничения
+    statement_timeout = None
+    query_budget = None
+    degraded_actions = ()
+    # Параметры запроса, от которых зависит ответ; остальные в ключ кэша не попадают
+    degraded_params = ()
+
+    def dispatch(self, request, *args, **kwargs):
+        self.admitted = not settings.DEGRADED_MODE and limiter.acquire(get_queue_time(request))
+        try:
+            with query_guard(self.__class__.__name__, self.query_budget, self.statement_timeout):
+                return super().dispatch(request, *args, **kwargs)
+        finally:
+            if self.admitted:
+                limiter.release()
+
+    def initial(self, request, *args, **kwargs):
+        if not self.admitted:
+            raise Overloaded()
+        super().initial(request, *args, **kwargs)
+
+    def handle_exception(self, exc):
+        if isinstance(exc, (OperationalError, QueryBudgetExceeded)):
+            logger.warning('%s: %s', self.__class__.__name__, exc)
+            metrics.incr('limiter.db_errors')
+            exc = Overloaded()
+        if isinstance(exc, Overloaded):
+            data = self.get_degraded_data()
+            if data is not None:
+                metrics.incr('limiter.degraded')
+                return Response(data, headers={'X-Degraded': '1'})
+            metrics.incr('limiter.rejected')
+        return super().handle_exception(exc)
+
+    def finalize_response(self, request, response, *args, **kwargs):
+        response = super().finalize_response(request, response, *args, **kwargs)
+        key = self.get_degraded_cache_key()
+        if key and response.status_code == 200 and not response.has_header('X-Degraded'):
+            # Снимок обновляется не чаще раза в DEGRADED_SNAPSHOT_MAX_AGE
+            snapshot = cache.get(key)
+            if snapshot is None or time.time() - snapshot[0] > settings.DEGRADED_SNAPSHOT_MAX_AGE:
+                cache.set(key, (time.time(), response.data), settings.DEGRADED_CACHE_TTL)
+        return response
+
+    def get_degraded_cache_key(self):
+        if self.request.method != 'GET' or getattr(self, 'action', None) not in self.degraded_actions:
+            return None
+        params = urlencode(sorted(
+            (name, value) for name in self.degraded_params for value in self.request.query_params.getlist(name)
+        ))
+        return f'degraded:{get_language()}:{self.request.path}?{params}'
+
+    def get_degraded_data(self):
+        key = self.get_degraded_cache_key()
+        snapshot = cache.get(key) if key else None
+        return snapshot[1] if snapshot is not None else None
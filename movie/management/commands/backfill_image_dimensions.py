@@ -0,0 +1,32 @@
+from django.core.management.base import BaseCommand
+
+from movie.models import Actor, Movie, MovieShots
+
+IMAGE_FIELDS = ((Actor, 'image'), (Movie, 'poster'), (MovieShots, 'images'))
+
+
+class Command(BaseCommand):
+    """ Заполнение сохранённых размеров изображений для уже загруженных файлов """
+    help = 'Читает размеры изображений Actor, Movie и MovieShots и сохраняет их в *_width/*_height'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=200)
+
+    def handle(self, *args, **options):
+        for model, name in IMAGE_FIELDS:
+            field = model._meta.get_field(name)
+            queryset = model.objects.filter(**{f'{field.width_field}__isnull': True}).exclude(**{name: ''})
+            updated = missing = 0
+            batch = []
+            for obj in queryset.iterator(chunk_size=options['batch_size']):
+                try:
+                    field.update_dimension_fields(obj, force=True)
+                except OSError:
+                    missing += 1
+                    continue
+                batch.append(obj)
+                if len(batch) >= options['batch_size']:
+                    updated += model.objects.bulk_update(batch, [field.width_field, field.height_field])
+                    batch = []
+            updated += model.objects.bulk_update(batch, [field.width_field, field.height_field])
+            self.stdout.write(f'{model.__name__}.{name}: обновлено {updated}, файлов не найдено {missing}')
@@ -0,0 +1,49 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from movie.models import Rating
+from movie.service import get_voter_key
+
+
+class Command(BaseCommand):
+    """ Перенос старых голосов из Rating.ip в компактный Rating.voter пачками """
+    help = 'Заполняет Rating.voter по Rating.ip и очищает ip'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=10000)
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        last_pk = 0
+        updated = deleted = 0
+        while True:
+            batch = list(
+                Rating.objects.filter(pk__gt=last_pk, voter__isnull=True)
+                .exclude(ip__isnull=True).order_by('pk').only('pk', 'ip', 'movie_id')[:batch_size]
+            )
+            if not batch:
+                break
+            last_pk = batch[-1].pk
+            for rating in batch:
+                rating.voter = get_voter_key(rating.ip)
+                rating.ip = None
+            with transaction.atomic():
+                # Если с этого IP уже проголосовали после деплоя, новый голос важнее старого
+                existing = set(Rating.objects.filter(
+                    movie_id__in={rating.movie_id for rating in batch},
+                    voter__in={rating.voter for rating in batch},
+                ).values_list('movie_id', 'voter'))
+                stale, seen, fresh = [], set(), []
+                for rating in reversed(batch):
+                    key = (rating.movie_id, rating.voter)
+                    if key in existing or key in seen:
+                        stale.append(rating.pk)
+                    else:
+                        seen.add(key)
+                        fresh.append(rating)
+                Rating.objects.filter(pk__in=stale).delete()
+                Rating.objects.bulk_update(fresh, ['voter', 'ip'])
+            updated += len(fresh)
+            deleted += len(stale)
+            self.stdout.write(f'... до id={last_pk}: обновлено {updated}, удалено дублей {deleted}')
+        self.stdout.write(self.style.SUCCESS(f'Готово: обновлено {updated}, удалено дублей {deleted}'))
@@ -0,0 +1,27 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from movie.documents import rebuild_movie_documents, render_movie_document
+from movie.models import MovieDocument
+
+
+class Command(BaseCommand):
+    """ Сверка сохранённых документов фильмов со свежей сериализацией """
+    help = 'Сравнивает MovieDocument с ответом MovieDetailSerializer'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--fix', action='store_true', help='Пересобрать расходящиеся документы')
+
+    def handle(self, *args, **options):
+        stale = set()
+        documents = MovieDocument.objects.select_related('movie').order_by('movie_id')
+        for document in documents.iterator(chunk_size=100):
+            if document.movie.draft or document.document != render_movie_document(document.movie, document.language):
+                self.stdout.write(f'Расхождение: фильм {document.movie_id}, язык {document.language}')
+                stale.add(document.movie_id)
+        if not stale:
+            self.stdout.write(self.style.SUCCESS('Все документы актуальны'))
+            return
+        if not options['fix']:
+            raise CommandError(f'Устаревших документов у фильмов: {len(stale)}')
+        rebuild_movie_documents(sorted(stale))
+        self.stdout.write(self.style.SUCCESS(f'Пересобраны документы фильмов: {len(stale)}'))
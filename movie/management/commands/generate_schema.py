@@ -0,0 +1,21 @@
+import os
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from Django_movie_drf.yasg import get_schema_file, write_schema
+
+
+class Command(BaseCommand):
+    """ Генерация схемы OpenAPI в файл при сборке/деплое """
+    help = 'Генерирует схему OpenAPI для текущей версии кода (CODE_VERSION)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--force', action='store_true', help='Перегенерировать, даже если файл уже есть')
+
+    def handle(self, *args, **options):
+        if not options['force'] and os.path.exists(get_schema_file()):
+            self.stdout.write(f'Схема для версии {settings.CODE_VERSION} уже сгенерирована')
+            return
+        schema_file = write_schema()
+        self.stdout.write(self.style.SUCCESS(f'Схема записана в {schema_file}'))
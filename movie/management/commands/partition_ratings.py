@@ -0,0 +1,63 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+
+from movie.models import Rating
+
+PARTITIONED_SQL = """
+CREATE SEQUENCE {table}_part_id_seq;
+CREATE TABLE {table}_part (LIKE {table} INCLUDING DEFAULTS) PARTITION BY HASH (movie_id);
+ALTER TABLE {table}_part ALTER COLUMN id SET DEFAULT nextval('{table}_part_id_seq');
+ALTER SEQUENCE {table}_part_id_seq OWNED BY {table}_part.id;
+ALTER TABLE {table}_part ADD PRIMARY KEY (id, movie_id);
+{partitions}
+INSERT INTO {table}_part SELECT * FROM {table};
+SELECT setval('{table}_part_id_seq', COALESCE((SELECT MAX(id) FROM {table}_part), 0) + 1, false);
+ALTER TABLE {table} RENAME TO {table}_old;
+ALTER TABLE {table}_part RENAME TO {table};
+ALTER TABLE {table}_old RENAME CONSTRAINT unique_rating_movie_voter TO unique_rating_movie_voter_old;
+ALTER TABLE {table} ADD CONSTRAINT unique_rating_movie_voter UNIQUE (movie_id, voter);
+CREATE INDEX {table}_voted_at_part ON {table} (voted_at);
+CREATE INDEX {table}_star_id_part ON {table} (star_id);
+ALTER TABLE {table} ADD FOREIGN KEY (movie_id) REFERENCES {movie_table} (id) DEFERRABLE INITIALLY DEFERRED;
+ALTER TABLE {table} ADD FOREIGN KEY (star_id) REFERENCES {star_table} (id) DEFERRABLE INITIALLY DEFERRED;
+"""
+
+
+class Command(BaseCommand):
+    """ Перевод таблицы Rating в секционированную по HASH(movie_id) на PostgreSQL """
+    help = 'Секционирует таблицу голосов на PostgreSQL; на остальных СУБД таблица остаётся обычной'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--partitions', type=int, default=settings.RATING_PARTITIONS)
+
+    def handle(self, *args, **options):
+        if connection.vendor != 'postgresql':
+            self.stdout.write(f'{connection.vendor}: секционирование не поддерживается, Rating остаётся обычной таблицей')
+            return
+        table = Rating._meta.db_table
+        with connection.cursor() as cursor:
+            cursor.execute(
+                'SELECT 1 FROM pg_partitioned_table p JOIN pg_class c ON c.oid = p.partrelid WHERE c.relname = %s',
+                [table],
+            )
+            if cursor.fetchone():
+                self.stdout.write(f'{table} уже секционирована')
+                return
+        count = options['partitions']
+        partitions = '\n'.join(
+            f'CREATE TABLE {table}_p{i} PARTITION OF {table}_part FOR VALUES WITH (MODULUS {count}, REMAINDER {i});'
+            for i in range(count)
+        )
+        sql = PARTITIONED_SQL.format(
+            table=table,
+            partitions=partitions,
+            movie_table=Rating._meta.get_field('movie').related_model._meta.db_table,
+            star_table=Rating._meta.get_field('star').related_model._meta.db_table,
+        )
+        with transaction.atomic(), connection.cursor() as cursor:
+            cursor.execute(f'LOCK TABLE {table} IN EXCLUSIVE MODE')
+            cursor.execute(sql)
+        self.stdout.write(self.style.SUCCESS(
+            f'{table} секционирована на {count} частей; старая таблица сохранена как {table}_old'
+        ))
@@ -0,0 +1,28 @@
+from django.core.management.base import BaseCommand
+
+from movie.models import Movie
+
+
+class Command(BaseCommand):
+    """ Заполнение очищенного описания, выдержки и длины для уже сохранённых фильмов """
+    help = 'Пересчитывает description_html, excerpt и description_length пачками'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500)
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        last_pk = 0
+        total = 0
+        while True:
+            movies = list(
+                Movie.objects.filter(pk__gt=last_pk).order_by('pk').only('pk', 'description')[:batch_size]
+            )
+            if not movies:
+                break
+            last_pk = movies[-1].pk
+            for movie in movies:
+                movie.preprocess_description()
+            Movie.objects.bulk_update(movies, ['description_html', 'excerpt', 'description_length'])
+            total += len(movies)
+        self.stdout.write(self.style.SUCCESS(f'Обработано фильмов: {total}'))
@@ -0,0 +1,17 @@
+from django.core.management.base import BaseCommand
+
+from movie.documents import rebuild_movie_documents
+
+
+class Command(BaseCommand):
+    """ Пересборка документов детальной страницы фильмов """
+    help = 'Пересобирает MovieDocument для всех опубликованных фильмов (или для --movie)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--movie', type=int, action='append', help='id фильма, можно несколько раз')
+        parser.add_argument('--workers', type=int, default=4)
+        parser.add_argument('--batch-size', type=int, default=100)
+
+    def handle(self, *args, **options):
+        count = rebuild_movie_documents(options['movie'], options['workers'], options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(f'Пересобрано документов: {count}'))
@@ -0,0 +1,68 @@
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import models, transaction
+from django.db.models.functions import TruncDate
+from django.utils import timezone
+
+from movie.models import Rating, RatingRollup, RolledUpVote
+
+
+class Command(BaseCommand):
+    """ Свёртка старых голосов в RatingRollup (фильм, звезда, день) """
+    help = 'Переносит голоса старше RATING_RETENTION_DAYS из Rating в дневные агрегаты RatingRollup'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, default=settings.RATING_RETENTION_DAYS)
+        parser.add_argument('--batch-size', type=int, default=10000)
+
+    def handle(self, *args, **options):
+        cutoff = timezone.now() - timedelta(days=options['days'])
+        # Голоса старше этого дня в RolledUpVote не попадают и оттуда удаляются
+        self.revote_day = (cutoff - timedelta(days=settings.RATING_REVOTE_WINDOW_DAYS)).date()
+        total = 0
+        while True:
+            with transaction.atomic():
+                pks = list(
+                    Rating.objects.select_for_update().filter(voted_at__lt=cutoff).order_by('pk')
+                    .values_list('pk', flat=True)[:options['batch_size']]
+                )
+                if not pks:
+                    break
+                self.rollup(pks)
+                # Без загрузки строк и сигналов rating_changed: средние не меняются, меняется только место хранения
+                Rating.objects.filter(pk__in=pks)._raw_delete(Rating.objects.db)
+            total += len(pks)
+            self.stdout.write(f'... свёрнуто голосов: {total}')
+        with transaction.atomic():
+            expired = RolledUpVote.objects.filter(day__lt=self.revote_day)
+            expired._raw_delete(expired.db)
+        self.stdout.write(self.style.SUCCESS(f'Готово: свёрнуто голосов {total}'))
+
+    def rollup(self, pks):
+        rows = Rating.objects.filter(pk__in=pks).values(
+            'movie_id', star_value=models.F('star__value'), day=TruncDate('voted_at')
+        ).annotate(count=models.Count('id'))
+        counts = {(row['movie_id'], row['star_value'], row['day']): row['count'] for row in rows}
+        RolledUpVote.objects.bulk_create([
+            RolledUpVote(movie_id=movie_id, voter=voter, star=star, day=day)
+            for movie_id, voter, star, day in Rating.objects.filter(pk__in=pks, voter__isnull=False).values_list(
+                'movie_id', 'voter', 'star__value', TruncDate('voted_at')
+            )
+            if day >= self.revote_day
+        ])
+        existing = RatingRollup.objects.select_for_update().filter(
+            movie_id__in={key[0] for key in counts}, day__in={key[2] for key in counts}
+        )
+        updated = []
+        for rollup in existing:
+            count = counts.pop((rollup.movie_id, rollup.star, rollup.day), None)
+            if count is not None:
+                rollup.votes = models.F('votes') + count
+                updated.append(rollup)
+        RatingRollup.objects.bulk_update(updated, ['votes'])
+        RatingRollup.objects.bulk_create([
+            RatingRollup(movie_id=movie_id, star=star, day=day, votes=count)
+            for (movie_id, star, day), count in counts.items()
+        ])
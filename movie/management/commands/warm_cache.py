@@ -0,0 +1,45 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from movie.documents import rebuild_movie_documents
+from movie.warmup import get_top_movie_ids, warm_up, warm_up_facets
+
+
+class Command(BaseCommand):
+    """ Прогрев кэшей после деплоя """
+    help = (
+        'Пересобирает документы популярных фильмов и фасеты фильтра; '
+        'дополнительно запрашивает URL из WARMUP_URLS или --urls-file'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--base-url', help='Адрес приложения, по умолчанию WARMUP_BASE_URL')
+        parser.add_argument('--concurrency', type=int, help='Одновременных запросов, по умолчанию WARMUP_CONCURRENCY')
+        parser.add_argument('--top', type=int, help='Сколько самых оцениваемых фильмов прогреть')
+        parser.add_argument('--urls-file', help='Файл с URL (по одному в строке), например из статистики доступа')
+
+    def handle(self, *args, **options):
+        top = settings.WARMUP_TOP_MOVIES if options['top'] is None else options['top']
+        # Документы популярных фильмов пачкой, а не по одному на каждый запрос
+        documents = rebuild_movie_documents(get_top_movie_ids(top))
+        facets = warm_up_facets()
+        self.stdout.write(self.style.SUCCESS(f'Документов фильмов: {documents}, наборов фасетов: {facets}'))
+
+        if options['urls_file']:
+            with open(options['urls_file']) as f:
+                urls = [line.strip() for line in f if line.strip()]
+        else:
+            urls = list(settings.WARMUP_URLS)
+        if not urls:
+            return
+        base_url = options['base_url'] or settings.WARMUP_BASE_URL
+        if not base_url:
+            raise CommandError('Для запроса URL нужен --base-url или WARMUP_BASE_URL')
+        results = warm_up(urls, base_url, concurrency=options['concurrency'])
+        failed = [result for result in results if result[2] != 200]
+        for url, language, status, seconds in failed:
+            self.stdout.write(self.style.WARNING(f'{status} {language} {url} ({seconds:.2f} с)'))
+        total = sum(result[3] for result in results)
+        self.stdout.write(self.style.SUCCESS(
+            f'Прогрето URL: {len(results) - len(failed)} из {len(results)}, суммарно {total:.1f} с'
+        ))
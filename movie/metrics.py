@@ -0,0 +1,25 @@
+import threading
+from collections import Counter
+
+_lock = threading.Lock()
+_counters = Counter()
+_gauges = {}
+
+
+def incr(name, value=1):
+    """ Увеличить счётчик процесса """
+    with _lock:
+        _counters[name] += value
+
+
+def gauge(name, func):
+    """ Показатель, который считывается func() в момент snapshot() """
+    _gauges[name] = func
+
+
+def snapshot():
+    """ Текущие значения всех счётчиков и показателей процесса """
+    with _lock:
+        values = dict(_counters)
+    values.update({name: func() for name, func in _gauges.items()})
+    return values
@@ -1,9 +1,34 @@
+from django.conf import settings
 from django.db import models
+from django.utils import timezone
 from datetime import date
 from ckeditor_uploader.fields import RichTextUploadingField
 
 from django.urls import reverse
 
+from .richtext import preprocess_rich_text
+
+
+class StoredDimensionsImageField(models.ImageField):
+    """ ImageField с width_field/height_field, который не открывает файл при каждой загрузке модели из БД
+
+    Стандартное поле читает изображение в post_init, пока размеры пустые (и падает, если файла нет).
+    Здесь размеры считаются только при сохранении; старые записи заполняет backfill_image_dimensions.
+    """
+
+    def contribute_to_class(self, cls, name, **kwargs):
+        super().contribute_to_class(cls, name, **kwargs)
+        models.signals.post_init.disconnect(self.update_dimension_fields, sender=cls)
+
+    def pre_save(self, model_instance, add):
+        file = super().pre_save(model_instance, add)
+        if file and getattr(model_instance, self.width_field) is None:
+            try:
+                self.update_dimension_fields(model_instance, force=True)
+            except OSError:
+                pass
+        return file
+
 
 class Category(models.Model):
     """ Категория """
@@ -26,7 +51,11 @@ class Actor(models.Model):
     name = models.CharField("Имя", max_length=50)
     age = models.PositiveSmallIntegerField("Возраст", default=0)
     description = models.TextField("Описание", blank=True)
-    image = models.ImageField("Изображение", upload_to="actors/")
+    image = StoredDimensionsImageField(
+        "Изображение", upload_to="actors/", width_field="image_width", height_field="image_height"
+    )
+    image_width = models.PositiveIntegerField("Ширина изображения", null=True, editable=False)
+    image_height = models.PositiveIntegerField("Высота изображения", null=True, editable=False)
 
     def get_absolute_url(self):
         return reverse('actor_detail', kwargs={'slug': self.name})
@@ -60,7 +89,17 @@ class Movie(models.Model):
     title = models.CharField("Называние", max_length=50, unique=True)
     tagline = models.CharField("Слоган", max_length=100, default="")
     description = RichTextUploadingField("Описание")
-    poster = models.ImageField("Постер", upload_to="movies/")
+    # Заполняются при сохранении из description, см. Movie.save
+    description_html = models.TextField("Описание (очищенное)", blank=True, editable=False)
+    excerpt = models.TextField("Краткое описание", blank=True, editable=False)
+    description_length = models.PositiveIntegerField(
+        "Длина описания", default=0, editable=False, help_text="Символов текста без разметки"
+    )
+    poster = StoredDimensionsImageField(
+        "Постер", upload_to="movies/", width_field="poster_width", height_field="poster_height"
+    )
+    poster_width = models.PositiveIntegerField("Ширина постера", null=True, editable=False)
+    poster_height = models.PositiveIntegerField("Высота постера", null=True, editable=False)
     year = models.PositiveSmallIntegerField("Дата выхода", default=2021)
     country = models.CharField("Страна", max_length=30)
     directors = models.ManyToManyField(Actor, related_name='film_director', verbose_name="Режиссер")
@@ -83,6 +122,20 @@ class Movie(models.Model):
     def get_absolute_url(self):
         return reverse('movie_detail', kwargs={'slug': self.slug})
 
+    def save(self, *args, **kwargs):
+        update_fields = kwargs.get('update_fields')
+        if 'description' not in self.get_deferred_fields() and (update_fields is None or 'description' in update_fields):
+            self.preprocess_description()
+            if update_fields is not None:
+                kwargs['update_fields'] = {*update_fields, 'description_html', 'excerpt', 'description_length'}
+        super().save(*args, **kwargs)
+
+    def preprocess_description(self):
+        """ Очищенный HTML, выдержка и длина текста описания """
+        self.description_html, self.excerpt, self.description_length = preprocess_rich_text(
+            self.description, settings.MOVIE_EXCERPT_LENGTH
+        )
+
     def __str__(self):
         return self.title
 
@@ -96,7 +149,11 @@ class MovieShots(models.Model):
     """ Кадры из фильма """
     title = models.CharField("Заголовок", max_length=50)
     description = models.TextField("Описание")
-    images = models.ImageField("Изображение", upload_to="movie_shots/")
+    images = StoredDimensionsImageField(
+        "Изображение", upload_to="movie_shots/", width_field="images_width", height_field="images_height"
+    )
+    images_width = models.PositiveIntegerField("Ширина изображения", null=True, editable=False)
+    images_height = models.PositiveIntegerField("Высота изображения", null=True, editable=False)
     movie = models.ForeignKey(Movie, on_delete=models.CASCADE, verbose_name="Фильм", related_name='movieshots')
 
     class Meta:
@@ -122,20 +179,69 @@ class RatingStar(models.Model):
 
 class Rating(models.Model):
     """ Рейтинг """
-    ip = models.CharField("IP адрес", max_length=15)
+    voter = models.BigIntegerField("Ключ голосующего", null=True, help_text="Хеш IP адреса, см. get_voter_key")
+    # Устаревшее поле: после backfill_rating_voters пустое и будет удалено
+    ip = models.CharField("IP адрес", max_length=15, null=True, blank=True)
     star = models.ForeignKey(RatingStar, on_delete=models.CASCADE, verbose_name="Звезда")
     movie = models.ForeignKey(
         Movie, on_delete=models.CASCADE, verbose_name="Фильм", related_name="ratings"
     )
+    voted_at = models.DateTimeField("Время голоса", default=timezone.now, db_index=True)
 
     class Meta:
         verbose_name = "Рейтинг"
         verbose_name_plural = "Рейтинги"
+        constraints = [
+            models.UniqueConstraint(fields=['movie', 'voter'], name='unique_rating_movie_voter'),
+        ]
 
     def __str__(self):
         return f'{self.star} - {self.movie}'
 
 
+class RatingRollup(models.Model):
+    """ Голоса за день, свёрнутые из Rating командой rollup_ratings """
+    movie = models.ForeignKey(
+        Movie, on_delete=models.CASCADE, verbose_name="Фильм", related_name="rating_rollups"
+    )
+    star = models.PositiveSmallIntegerField("Звезда")
+    day = models.DateField("День")
+    votes = models.PositiveIntegerField("Голосов", default=0)
+
+    class Meta:
+        verbose_name = "Рейтинг за день"
+        verbose_name_plural = "Рейтинги за день"
+        constraints = [
+            models.UniqueConstraint(fields=['movie', 'star', 'day'], name='unique_rating_rollup_movie_star_day'),
+        ]
+
+    def __str__(self):
+        return f'{self.movie_id} - {self.day} - {self.star}: {self.votes}'
+
+
+class RolledUpVote(models.Model):
+    """ Чей голос свёрнут в RatingRollup: по нему повторный голос находит и заменяет старый
+
+    Хранится только RATING_REVOTE_WINDOW_DAYS, дальше свёрнутый голос окончательный.
+    """
+    movie = models.ForeignKey(
+        Movie, on_delete=models.CASCADE, verbose_name="Фильм", related_name="rolled_up_votes"
+    )
+    voter = models.BigIntegerField("Голосующий")
+    star = models.PositiveSmallIntegerField("Звезда")
+    day = models.DateField("День", db_index=True)
+
+    class Meta:
+        verbose_name = "Свёрнутый голос"
+        verbose_name_plural = "Свёрнутые голоса"
+        constraints = [
+            models.UniqueConstraint(fields=['movie', 'voter'], name='unique_rolled_up_vote_movie_voter'),
+        ]
+
+    def __str__(self):
+        return f'{self.movie_id} - {self.voter}: {self.star}'
+
+
 class Review(models.Model):
     """ Отзыв """
     email = models.EmailField("E-mail")
@@ -152,3 +258,21 @@ class Review(models.Model):
 
     def __str__(self):
         return f'{self.name} - {self.movie}'
+
+
+class MovieDocument(models.Model):
+    """ Готовый ответ MovieDetailSerializer для фильма на одном языке """
+    movie = models.ForeignKey(Movie, on_delete=models.CASCADE, verbose_name="Фильм", related_name="documents")
+    language = models.CharField("Язык", max_length=10)
+    document = models.JSONField("Документ")
+    updated = models.DateTimeField("Обновлен", auto_now=True)
+
+    class Meta:
+        verbose_name = "Документ фильма"
+        verbose_name_plural = "Документы фильмов"
+        constraints = [
+            models.UniqueConstraint(fields=['movie', 'language'], name='unique_movie_document_language'),
+        ]
+
+    def __str__(self):
+        return f'{self.movie_id} - {self.language}'
@@ -0,0 +1,67 @@
+import threading
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.utils.translation import get_language
+
+from .models import Category, Genre, RatingStar
+
+VERSION_KEY = 'movie:reference:version'
+
+
+class ReferenceData:
+    """ Справочники Genre, Category и RatingStar в памяти процесса
+
+    Версия хранится в общем кэше: изменение строки в админке меняет версию,
+    и каждый процесс перечитывает справочники не позже чем через
+    REFERENCE_DATA_CHECK_INTERVAL секунд. Если версия из кэша пропала,
+    справочники всё равно перечитываются раз в REFERENCE_DATA_MAX_AGE секунд.
+    """
+    models = {'genre': Genre, 'category': Category, 'star': RatingStar}
+
+    def __init__(self):
+        self._tables = None
+        self._version = None
+        self._checked = 0
+        self._loaded = 0
+        self._lock = threading.Lock()
+
+    def table(self, name):
+        """ {id: объект} для справочника """
+        now = time.monotonic()
+        tables = self._tables
+        if tables is None or now - self._checked > settings.REFERENCE_DATA_CHECK_INTERVAL:
+            with self._lock:
+                version = cache.get(VERSION_KEY)
+                if (
+                    self._tables is None or version != self._version
+                    or now - self._loaded > settings.REFERENCE_DATA_MAX_AGE
+                ):
+                    self._tables = {
+                        key: {obj.pk: obj for obj in model.objects.all()} for key, model in self.models.items()
+                    }
+                    self._version = version
+                    self._loaded = now
+                self._checked = now
+                tables = self._tables
+        return tables[name]
+
+    def get(self, name, pk):
+        return self.table(name).get(pk)
+
+    def title(self, name, pk, language=None):
+        """ Название на языке запроса (поля title_<язык> из translation.py), иначе основное """
+        obj = self.get(name, pk)
+        if obj is None:
+            return None
+        language = (language or get_language() or settings.LANGUAGE_CODE).replace('-', '_')
+        return getattr(obj, f'title_{language}', None) or obj.title
+
+    def invalidate(self):
+        """ Сбросить справочники во всех процессах """
+        cache.set(VERSION_KEY, time.time_ns(), None)
+        self._tables = None
+
+
+reference_data = ReferenceData()
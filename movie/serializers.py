@@ -1,6 +1,12 @@
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
 from rest_framework import serializers
+from rest_framework.settings import api_settings
 
 from movie.models import Movie, Review, Rating, Actor
+from movie.reference import reference_data
+from movie.service import release_rolled_up_votes
 
 
 class MovieListSerializer(serializers.ModelSerializer):
@@ -13,19 +19,103 @@ class MovieListSerializer(serializers.ModelSerializer):
         fields = ["id", "title", "tagline", "category", "rating_user", "middle_star"]
 
 
+class BatchListSerializer(serializers.ListSerializer):
+    """ Пакетная запись: невалидные элементы не мешают остальным, ошибки собираются по индексам """
+
+    def __init__(self, *args, **kwargs):
+        kwargs.setdefault('max_length', settings.BATCH_MAX_SIZE)
+        kwargs.setdefault('allow_empty', False)
+        super().__init__(*args, **kwargs)
+        # {имя поля: {pk: объект}} для BatchPrimaryKeyRelatedField
+        self.related_cache = {}
+        self.item_indexes = []
+        self.item_errors = {}
+
+    def to_internal_value(self, data):
+        if not isinstance(data, list):
+            self.fail_list('not_a_list', input_type=type(data).__name__)
+        if not data:
+            self.fail_list('empty')
+        if len(data) > self.max_length:
+            self.fail_list('max_length', max_length=self.max_length)
+        ret = []
+        for index, item in enumerate(data):
+            try:
+                validated = self.child.run_validation(item)
+            except serializers.ValidationError as exc:
+                self.item_errors[index] = exc.detail
+            else:
+                ret.append(validated)
+                self.item_indexes.append(index)
+        return ret
+
+    def fail_list(self, key, **kwargs):
+        message = self.error_messages[key].format(**kwargs)
+        raise serializers.ValidationError({api_settings.NON_FIELD_ERRORS_KEY: [message]}, code=key)
+
+    def get_results(self):
+        """ Результат по каждому элементу пакета в исходном порядке """
+        results = [
+            {'index': index, 'data': self.child.to_representation(obj)}
+            for index, obj in zip(self.item_indexes, self.instance or [])
+        ]
+        results += [{'index': index, 'errors': errors} for index, errors in self.item_errors.items()]
+        return sorted(results, key=lambda result: result['index'])
+
+
+class BatchPrimaryKeyRelatedField(serializers.PrimaryKeyRelatedField):
+    """ В пакете все связанные объекты загружаются одним запросом вместо запроса на элемент """
+
+    def to_internal_value(self, data):
+        cache = getattr(self.root, 'related_cache', None)
+        if cache is None:
+            return super().to_internal_value(data)
+        if self.field_name not in cache:
+            pks = set()
+            for item in self.root.initial_data:
+                try:
+                    pks.add(int(item.get(self.field_name)))
+                except (AttributeError, TypeError, ValueError):
+                    pass
+            cache[self.field_name] = self.get_queryset().only('pk').in_bulk(pks)
+        if isinstance(data, bool):
+            self.fail('incorrect_type', data_type=type(data).__name__)
+        try:
+            obj = cache[self.field_name].get(int(data))
+        except (TypeError, ValueError):
+            self.fail('incorrect_type', data_type=type(data).__name__)
+        if obj is None:
+            self.fail('does_not_exist', pk_value=data)
+        return obj
+
+
+class ReviewBatchSerializer(BatchListSerializer):
+    """ Пакет отзывов одним INSERT """
+
+    def create(self, validated_data):
+        with transaction.atomic():
+            return Review.objects.bulk_create([Review(**item) for item in validated_data])
+
+
 class ReviewCreateSerializer(serializers.ModelSerializer):
     """ Добавление отзыва """
+    movie = BatchPrimaryKeyRelatedField(queryset=Movie.objects.all(), label="Фильм")
+    parent = BatchPrimaryKeyRelatedField(
+        queryset=Review.objects.all(), required=False, allow_null=True, label="Родитель"
+    )
 
     class Meta:
         model = Review
         fields = '__all__'
+        list_serializer_class = ReviewBatchSerializer
 
 
 class FilterReviewListSerializer(serializers.ListSerializer):
     """ Фильтр комментариев, только parents """
 
     def to_representation(self, data):
-        data = data.filter(parent=None)
+        # .all() вместо .filter(): так используются отзывы, загруженные prefetch_review_trees
+        data = [review for review in data.all() if review.parent_id is None]
         return super().to_representation(data)
 
 
@@ -52,7 +142,7 @@ class ActorListSerializer(serializers.ModelSerializer):
 
     class Meta:
         model = Actor
-        fields = ('id', 'name', 'image')
+        fields = ('id', 'name', 'image', 'image_width', 'image_height')
 
 
 class ActorDetailSerializer(serializers.ModelSerializer):
@@ -63,30 +153,118 @@ class ActorDetailSerializer(serializers.ModelSerializer):
         fields = "__all__"
 
 
+class ReferenceTitleField(serializers.ReadOnlyField):
+    """ Название из справочника по id, без запроса к БД """
+
+    def __init__(self, table, **kwargs):
+        self.table = table
+        super().__init__(**kwargs)
+
+    def to_representation(self, value):
+        return reference_data.title(self.table, value)
+
+
+class ReferenceRelatedField(serializers.RelatedField):
+    """ Связь со справочником: проверка id по данным в памяти вместо запроса к БД """
+    default_error_messages = {
+        'does_not_exist': 'Недопустимый первичный ключ "{pk_value}" - объект не существует.',
+        'incorrect_type': 'Некорректный тип. Ожидалось значение первичного ключа, получен {data_type}.',
+    }
+
+    def __init__(self, table, **kwargs):
+        self.table = table
+        kwargs.setdefault('queryset', reference_data.models[table].objects.all())
+        super().__init__(**kwargs)
+
+    def to_internal_value(self, data):
+        try:
+            obj = reference_data.get(self.table, int(data))
+        except (TypeError, ValueError):
+            self.fail('incorrect_type', data_type=type(data).__name__)
+        if obj is None:
+            self.fail('does_not_exist', pk_value=data)
+        return obj
+
+    def to_representation(self, value):
+        return value.pk
+
+
+class FacetItemSerializer(serializers.Serializer):
+    """ Жанр или категория и число фильмов в них """
+    id = serializers.IntegerField()
+    title = serializers.CharField()
+    count = serializers.IntegerField()
+
+
+class FacetYearSerializer(serializers.Serializer):
+    """ Годы выпуска с from по to и число фильмов в них """
+    to = serializers.IntegerField()
+    count = serializers.IntegerField()
+
+    def get_fields(self):
+        # from - ключевое слово, атрибутом класса его не объявить
+        return {'from': serializers.IntegerField(), **super().get_fields()}
+
+
+class MovieFacetsSerializer(serializers.Serializer):
+    """ Фасеты фильмов для текущих фильтров (описание ответа movie/facets/) """
+    count = serializers.IntegerField()
+    genres = FacetItemSerializer(many=True)
+    categories = FacetItemSerializer(many=True)
+    years = FacetYearSerializer(many=True)
+
+
 class MovieDetailSerializer(serializers.ModelSerializer):
     """ Полный описание фильмов """
-    category = serializers.SlugRelatedField(slug_field="title", read_only=True)
+    category = ReferenceTitleField('category', source='category_id')
     directors = ActorListSerializer(read_only=True, many=True)
     actors = ActorListSerializer(read_only=True, many=True)
-    genres = serializers.SlugRelatedField(slug_field="title", read_only=True, many=True)
+    genres = serializers.SerializerMethodField()
     reviews = ReviewSerializer(many=True)
+    description = serializers.CharField(source='description_html', read_only=True)
 
     class Meta:
         model = Movie
-        exclude = ('draft',)
+        exclude = ('draft', 'description_html')
+
+    def get_genres(self, obj):
+        # genres.all() берёт жанры из prefetch_related в save_movie_documents
+        return [reference_data.title('genre', genre.pk) for genre in obj.genres.all()]
+
+
+class RatingBatchSerializer(BatchListSerializer):
+    """ Пакет оценок одним upsert по (movie, voter) """
+
+    def create(self, validated_data):
+        voted_at = timezone.now()
+        ratings = [Rating(voted_at=voted_at, **item) for item in validated_data]
+        # Повторная оценка того же фильма в пакете: побеждает последняя, как при записи по одной
+        latest = {(rating.movie_id, rating.voter): rating for rating in ratings}
+        with transaction.atomic():
+            release_rolled_up_votes(latest)
+            Rating.objects.bulk_create(
+                latest.values(), update_conflicts=True, unique_fields=['movie', 'voter'],
+                update_fields=['star', 'voted_at']
+            )
+        return ratings
 
 
 class CreateRatingSerializer(serializers.ModelSerializer):
     """ Добавление рейтинга пользователем """
+    star = ReferenceRelatedField('star')
+    movie = BatchPrimaryKeyRelatedField(queryset=Movie.objects.all(), label="Фильм")
 
     class Meta:
         model = Rating
         fields = ("star", "movie")
+        list_serializer_class = RatingBatchSerializer
 
     def create(self, validated_data):
-        rating, _ = Rating.objects.update_or_create(
-            ip=validated_data.get('ip', None),
-            movie=validated_data.get('movie', None),
-            defaults={'star': validated_data.get('star')}
-        )
+        with transaction.atomic():
+            release_rolled_up_votes([(validated_data['movie'].pk, validated_data.get('voter'))])
+            rating, _ = Rating.objects.update_or_create(
+                voter=validated_data.get('voter', None),
+                movie=validated_data.get('movie', None),
+                defaults={'star': validated_data.get('star'), 'voted_at': timezone.now()}
+            )
         return rating
@@ -1,8 +1,22 @@
+import hashlib
+import hmac
+import ipaddress
+import operator
+import time
+from collections import Counter
+from functools import lru_cache, reduce
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import models
+from django.db.models.functions import Coalesce, NullIf
+from django.utils.translation import get_language
 from django_filters import rest_framework as filters
 from rest_framework.pagination import PageNumberPagination
 from rest_framework.response import Response
 
-from movie.models import Movie
+from movie.models import Movie, Rating, RatingRollup, RolledUpVote
+from movie.reference import reference_data
 
 
 class PaginationMovies(PageNumberPagination):
@@ -20,15 +34,129 @@ class PaginationMovies(PageNumberPagination):
         })
 
 
+@lru_cache(maxsize=None)
+def get_trusted_proxies():
+    return tuple(ipaddress.ip_network(network) for network in settings.TRUSTED_PROXIES)
+
+
+@lru_cache(maxsize=4096)
+def is_trusted_proxy(ip):
+    try:
+        address = ipaddress.ip_address(ip)
+    except ValueError:
+        return False
+    return any(address in network for network in get_trusted_proxies())
+
+
 def get_client_ip(request):
+    """ IP клиента: X-Forwarded-For учитывается только от доверенных прокси (TRUSTED_PROXIES)
+
+    Цепочка разбирается справа налево, клиентом считается первый адрес не из TRUSTED_PROXIES.
+    """
+    ip = request.META.get('REMOTE_ADDR')
     x_forwarded_for = request.META.get('HTTP_X_FORWARDED_FOR')
-    if x_forwarded_for:
-        ip = x_forwarded_for.split(',')[0]
-    else:
-        ip = request.META.get('REMOTE_ADDR')
+    if x_forwarded_for and is_trusted_proxy(ip):
+        for ip in reversed([part.strip() for part in x_forwarded_for.split(',') if part.strip()]):
+            if not is_trusted_proxy(ip):
+                break
     return ip
 
 
+def defer_descriptions(queryset):
+    """ Не читать тяжёлые колонки описания (и их переводы description_<язык>) там, где они не нужны """
+    return queryset.defer(*[
+        field.name for field in Movie._meta.concrete_fields
+        if field.name.startswith('description') and field.name != 'description_length'
+    ])
+
+
+def rating_totals():
+    """ (сумма звёзд, число голосов) фильма: свежие голоса из Rating плюс свёрнутые из RatingRollup, без GROUP BY по фильмам """
+    raw = Rating.objects.filter(movie=models.OuterRef('pk')).order_by().values('movie')
+    rollup = RatingRollup.objects.filter(movie=models.OuterRef('pk')).order_by().values('movie')
+    stars = Coalesce(
+        models.Subquery(raw.annotate(total=models.Sum('star__value')).values('total')), 0
+    ) + Coalesce(
+        models.Subquery(rollup.annotate(total=models.Sum(models.F('star') * models.F('votes'))).values('total')), 0
+    )
+    votes = Coalesce(
+        models.Subquery(raw.annotate(total=models.Count('id')).values('total')), 0
+    ) + Coalesce(
+        models.Subquery(rollup.annotate(total=models.Sum('votes')).values('total')), 0
+    )
+    return stars, votes
+
+
+def annotate_ratings(queryset, voter):
+    """ rating_user и middle_star по rating_totals """
+    stars, votes = rating_totals()
+    return queryset.annotate(
+        rating_user=models.ExpressionWrapper(
+            models.Q(models.Exists(Rating.objects.filter(movie=models.OuterRef('pk'), voter=voter)))
+            | models.Q(models.Exists(RolledUpVote.objects.filter(movie=models.OuterRef('pk'), voter=voter))),
+            output_field=models.BooleanField()
+        ),
+        middle_star=stars / NullIf(votes, 0),
+    )
+
+
+def release_rolled_up_votes(votes):
+    """ Повторные голоса [(id фильма, voter)]: старые голоса уходят из RatingRollup, вызывать в транзакции записи
+
+    Три запроса на любой размер пакета.
+    """
+    movies_by_voter = {}
+    for movie_id, voter in votes:
+        movies_by_voter.setdefault(voter, set()).add(movie_id)
+    rolled = list(
+        RolledUpVote.objects.select_for_update().filter(reduce(operator.or_, [
+            models.Q(voter=voter, movie_id__in=movie_ids) for voter, movie_ids in movies_by_voter.items()
+        ])).values_list('pk', 'movie_id', 'star', 'day')
+    )
+    if not rolled:
+        return
+    counts = Counter((movie_id, star, day) for _, movie_id, star, day in rolled)
+    buckets = [models.Q(movie_id=movie_id, star=star, day=day) for movie_id, star, day in counts]
+    RatingRollup.objects.filter(reduce(operator.or_, buckets)).update(votes=models.F('votes') - models.Case(
+        *[
+            models.When(bucket, then=count)
+            for bucket, count in zip(buckets, counts.values())
+        ],
+        output_field=models.PositiveIntegerField()
+    ))
+    RolledUpVote.objects.filter(pk__in=[row[0] for row in rolled]).delete()
+
+
+def get_movie_ratings(movie_ids):
+    """ {id фильма: {'votes', 'average'}} по Rating и RatingRollup, два сгруппированных запроса """
+    totals = {}
+    raw = Rating.objects.filter(movie_id__in=movie_ids).values('movie').annotate(
+        stars=models.Sum('star__value'), votes=models.Count('id')
+    )
+    rollup = RatingRollup.objects.filter(movie_id__in=movie_ids).values('movie').annotate(
+        stars=models.Sum(models.F('star') * models.F('votes')), votes=models.Sum('votes')
+    )
+    for row in list(raw) + list(rollup):
+        total = totals.setdefault(row['movie'], {'stars': 0, 'votes': 0})
+        total['stars'] += row['stars']
+        total['votes'] += row['votes']
+    return {
+        movie_id: {'votes': total['votes'], 'average': total['stars'] / total['votes']}
+        for movie_id, total in totals.items()
+    }
+
+
+def get_voter_key(ip):
+    """ Ключ голосующего: первые 8 байт HMAC-SHA256 от IP (IPv4 и IPv6) вместо самого адреса """
+    ip = (ip or '').strip()
+    try:
+        raw = ipaddress.ip_address(ip).packed
+    except ValueError:
+        raw = ip.encode()
+    digest = hmac.new(settings.VOTER_KEY_SECRET.encode(), raw, hashlib.sha256).digest()
+    return int.from_bytes(digest[:8], 'big', signed=True)
+
+
 class CharFilterInFilter(filters.BaseInFilter, filters.CharFilter):
     pass
 
@@ -40,3 +168,63 @@ class MovieFilter(filters.FilterSet):
     class Meta:
         model = Movie
         fields = ['genres', 'year']
+
+
+FACETS_VERSION_KEY = 'movie:facets:version'
+
+
+def bump_facets_version():
+    """ Сбросить все закэшированные фасеты """
+    cache.set(FACETS_VERSION_KEY, time.time_ns(), None)
+
+
+def get_movie_facets(queryset):
+    """ Количество фильмов по жанрам, категориям и годам одним запросом: UNION ALL группировок
+
+    Строки (фасет, ключ, количество); названия жанров и категорий берутся из reference_data.
+    """
+    movie_ids = queryset.values('pk')
+    bucket = settings.FACETS_YEAR_BUCKET
+
+    def facet(queryset, name, key, count):
+        return queryset.annotate(
+            facet=models.Value(name, output_field=models.CharField()),
+            key=models.ExpressionWrapper(key, output_field=models.IntegerField()),
+        ).values('facet', 'key').annotate(count=models.Count(count)).order_by()
+
+    movies = Movie.objects.filter(pk__in=movie_ids)
+    rows = facet(movies, 'count', models.Value(0), 'id').union(
+        facet(Movie.genres.through.objects.filter(movie_id__in=movie_ids), 'genre', models.F('genre_id'), 'movie_id'),
+        facet(movies.filter(category__isnull=False), 'category', models.F('category_id'), 'id'),
+        facet(movies, 'year', models.F('year') / bucket * bucket, 'id'),
+        all=True,
+    )
+    facets = {'count': 0, 'genre': [], 'category': [], 'year': []}
+    for row in rows:
+        if row['facet'] == 'count':
+            facets['count'] = row['count']
+        elif row['facet'] == 'year':
+            facets['year'].append({'from': row['key'], 'to': row['key'] + bucket - 1, 'count': row['count']})
+        else:
+            title = reference_data.title(row['facet'], row['key'])
+            facets[row['facet']].append({'id': row['key'], 'title': title, 'count': row['count']})
+    for name in ('genre', 'category'):
+        facets[name].sort(key=lambda item: (-item['count'], item['title'] or ''))
+    return {
+        'count': facets['count'],
+        'genres': facets['genre'],
+        'categories': facets['category'],
+        'years': sorted(facets['year'], key=lambda item: item['from']),
+    }
+
+
+def get_cached_movie_facets(queryset, query_params):
+    """ Фасеты для набора фильтров из кэша; ключ зависит от параметров, языка и версии """
+    params = '&'.join(f'{key}={",".join(sorted(query_params.getlist(key)))}' for key in sorted(query_params))
+    version = cache.get(FACETS_VERSION_KEY, 0)
+    key = f'movie:facets:{version}:{get_language()}:{hashlib.md5(params.encode()).hexdigest()}'
+    facets = cache.get(key)
+    if facets is None:
+        facets = get_movie_facets(queryset)
+        cache.set(key, facets, settings.FACETS_CACHE_TTL)
+    return facets
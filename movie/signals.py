@@ -0,0 +1,138 @@
+from django.contrib.auth import get_user_model
+from django.contrib.auth.signals import user_logged_out
+from django.db import models, transaction
+from django.db.models.signals import m2m_changed, post_delete, post_save, pre_delete
+from django.dispatch import receiver
+from djoser.signals import user_activated
+from rest_framework.authtoken.models import Token
+
+from .authentication import invalidate_token, invalidate_user
+from .documents import invalidate_movie_documents
+from .events import publish_ratings, publish_reviews
+from .models import Actor, Category, Genre, Movie, MovieShots, Rating, RatingStar, Review
+from .reference import reference_data
+from .service import bump_facets_version
+
+
+@receiver(post_delete, sender=Token)
+def token_deleted(sender, instance, **kwargs):
+    """ Удаление токена, в том числе logout через djoser """
+    invalidate_token(instance.key)
+
+
+@receiver(post_save, sender=get_user_model())
+def user_saved(sender, instance, created, **kwargs):
+    """ Смена пароля, деактивация и любые другие изменения пользователя """
+    if not created:
+        invalidate_user(instance.pk)
+
+
+@receiver(post_delete, sender=get_user_model())
+def user_deleted(sender, instance, **kwargs):
+    invalidate_user(instance.pk)
+
+
+@receiver(user_activated)
+@receiver(user_logged_out)
+def user_session_changed(sender, user, **kwargs):
+    if user is not None:
+        invalidate_user(user.pk)
+
+
+@receiver(post_save, sender=Movie)
+@receiver(post_delete, sender=Movie)
+@receiver(post_save, sender=Genre)
+@receiver(post_delete, sender=Genre)
+@receiver(post_save, sender=Category)
+@receiver(post_delete, sender=Category)
+@receiver(m2m_changed, sender=Movie.genres.through)
+def movie_facets_changed(sender, **kwargs):
+    """ Черновик, жанры, категория или год фильма изменились """
+    transaction.on_commit(bump_facets_version)
+
+
+@receiver(post_save, sender=Genre)
+@receiver(post_delete, sender=Genre)
+@receiver(post_save, sender=Category)
+@receiver(post_delete, sender=Category)
+@receiver(post_save, sender=RatingStar)
+@receiver(post_delete, sender=RatingStar)
+def reference_data_changed(sender, **kwargs):
+    # После коммита: иначе другой процесс успеет перечитать старые строки под новой версией
+    transaction.on_commit(reference_data.invalidate)
+
+
+def invalidate_documents_on_commit(movie_ids):
+    """ Сбросить документы после коммита: иначе параллельный запрос пересоберёт документ
+    из старых данных и сохранит его уже после удаления. Id собираются сразу, до удаления строк.
+    """
+    movie_ids = list(movie_ids)
+    transaction.on_commit(lambda: invalidate_movie_documents(movie_ids))
+
+
+@receiver(post_save, sender=Movie)
+def movie_saved(sender, instance, **kwargs):
+    invalidate_documents_on_commit([instance.pk])
+
+
+@receiver(post_save, sender=Review)
+@receiver(post_delete, sender=Review)
+@receiver(post_save, sender=MovieShots)
+@receiver(post_delete, sender=MovieShots)
+def movie_part_changed(sender, instance, **kwargs):
+    """ Отзывы и кадры входят в документ фильма """
+    invalidate_documents_on_commit([instance.movie_id])
+
+
+@receiver(post_save, sender=Actor)
+@receiver(pre_delete, sender=Actor)
+def actor_saved(sender, instance, **kwargs):
+    invalidate_documents_on_commit(
+        Movie.objects.filter(models.Q(actors=instance) | models.Q(directors=instance))
+        .values_list('pk', flat=True).distinct()
+    )
+
+
+@receiver(post_save, sender=Genre)
+@receiver(pre_delete, sender=Genre)
+def genre_saved(sender, instance, **kwargs):
+    invalidate_documents_on_commit(
+        Movie.genres.through.objects.filter(genre_id=instance.pk).values_list('movie_id', flat=True)
+    )
+
+
+@receiver(post_save, sender=Category)
+@receiver(pre_delete, sender=Category)
+def category_saved(sender, instance, **kwargs):
+    invalidate_documents_on_commit(Movie.objects.filter(category_id=instance.pk).values_list('pk', flat=True))
+
+
+@receiver(m2m_changed, sender=Movie.actors.through)
+@receiver(m2m_changed, sender=Movie.directors.through)
+@receiver(m2m_changed, sender=Movie.genres.through)
+def movie_relations_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    """ Актёры, режиссёры и жанры фильма; reverse - изменение со стороны Actor или Genre """
+    if not reverse:
+        if action.startswith('post_'):
+            invalidate_documents_on_commit([instance.pk])
+    elif action == 'pre_clear':
+        invalidate_documents_on_commit(
+            sender.objects.filter(**{f'{instance._meta.model_name}_id': instance.pk})
+            .values_list('movie_id', flat=True)
+        )
+    elif action.startswith('post_') and pk_set:
+        invalidate_documents_on_commit(pk_set)
+
+
+@receiver(post_save, sender=Rating)
+@receiver(post_delete, sender=Rating)
+def rating_changed(sender, instance, **kwargs):
+    """ Подписчикам - только закоммиченные голоса и отзывы, как в пакетной записи """
+    movie_id = instance.movie_id
+    transaction.on_commit(lambda: publish_ratings([movie_id]))
+
+
+@receiver(post_save, sender=Review)
+def review_created(sender, instance, created, **kwargs):
+    if created:
+        transaction.on_commit(lambda: publish_reviews([instance]))
@@ -1,2 +1,87 @@
-from django.test import TestCase
+from django.test import SimpleTestCase
 
+from .richtext import preprocess_rich_text
+
+
+def clean(html, excerpt_length=300):
+    return preprocess_rich_text(html, excerpt_length)[0]
+
+
+class RichTextCleanerTests(SimpleTestCase):
+    """ Белый список HTML описаний фильмов: всё, что может выполнить скрипт, вырезается """
+
+    def test_allowed_markup_is_kept(self):
+        self.assertEqual(
+            clean('<p class="lead">Hello <b>world</b><br><a href="https://example.com/" title="t">link</a></p>'),
+            '<p class="lead">Hello <b>world</b><br><a href="https://example.com/" title="t">link</a></p>'
+        )
+
+    def test_javascript_urls_are_dropped(self):
+        for url in (
+            'javascript:alert(1)',
+            ' JaVaScRiPt:alert(1)',
+            'vbscript:msgbox(1)',
+            'data:text/html;base64,PHNjcmlwdD5hbGVydCgxKTwvc2NyaXB0Pg==',
+        ):
+            with self.subTest(url=url):
+                self.assertEqual(clean(f'<a href="{url}">x</a>'), '<a>x</a>')
+                self.assertEqual(clean(f'<img src="{url}">'), '<img>')
+
+    def test_entity_obfuscated_urls_are_dropped(self):
+        for url in (
+            '&#106;avascript:alert(1)',
+            '&#x6A;&#x61;&#x76;&#x61;script:alert(1)',
+            'java&#x09;script:alert(1)',
+            'java&#10;script:alert(1)',
+            'javascript&colon;alert(1)',
+        ):
+            with self.subTest(url=url):
+                self.assertEqual(clean(f'<a href="{url}">x</a>'), '<a>x</a>')
+
+    def test_relative_and_anchor_urls_are_kept(self):
+        self.assertEqual(clean('<a href="/movie/1/">x</a>'), '<a href="/movie/1/">x</a>')
+        self.assertEqual(clean('<a href="#top">x</a>'), '<a href="#top">x</a>')
+
+    def test_event_handler_attributes_are_dropped(self):
+        self.assertEqual(clean('<img src="/a.jpg" onerror="alert(1)">'), '<img src="/a.jpg">')
+        self.assertEqual(clean('<p onclick="alert(1)" ONMOUSEOVER="alert(2)">x</p>'), '<p>x</p>')
+        self.assertEqual(clean('<svg onload="alert(1)"><b>x</b></svg>'), '<b>x</b>')
+
+    def test_unsafe_styles_are_dropped(self):
+        self.assertEqual(clean('<p style="width: expression(alert(1))">x</p>'), '<p>x</p>')
+        self.assertEqual(clean('<p style="background: url(javascript:alert(1))">x</p>'), '<p>x</p>')
+        self.assertEqual(clean('<p style="color: red">x</p>'), '<p style="color: red">x</p>')
+
+    def test_attribute_values_are_escaped(self):
+        self.assertEqual(clean('<p title=\'"><script>alert(1)</script>\'>x</p>'),
+                         '<p title="&quot;&gt;&lt;script&gt;alert(1)&lt;/script&gt;">x</p>')
+
+    def test_script_style_iframe_bodies_are_dropped(self):
+        for tag in ('script', 'style', 'iframe', 'noscript', 'template'):
+            with self.subTest(tag=tag):
+                self.assertEqual(clean(f'<p>a<{tag}>alert(1)<b>x</b></{tag}>b</p>'), '<p>ab</p>')
+        # Внутри script разметки нет: тело заканчивается на первом </script>
+        self.assertEqual(clean('<script><script>alert(1)</script>x</script>ok'), 'xok')
+        self.assertEqual(clean('<SCRIPT>alert(1)</SCRIPT>ok'), 'ok')
+
+    def test_unclosed_and_stray_tags(self):
+        self.assertEqual(clean('<p><b>x'), '<p><b>x</b></p>')
+        self.assertEqual(clean('<p>x</b></i>y</p>'), '<p>xy</p>')
+        self.assertEqual(clean('x</p>'), 'x')
+        self.assertEqual(clean('<script>alert(1)'), '')
+
+    def test_text_is_escaped(self):
+        self.assertEqual(clean('&lt;script&gt;alert(1)&lt;/script&gt;'), '&lt;script&gt;alert(1)&lt;/script&gt;')
+        self.assertEqual(clean('1 < 2 & 3'), '1 &lt; 2 &amp; 3')
+
+    def test_excerpt(self):
+        html, excerpt, length = preprocess_rich_text('<p>Hello</p><p>big <b>world</b></p><script>x</script>', 300)
+        self.assertEqual(excerpt, 'Hello big world')
+        self.assertEqual(length, len('Hello big world'))
+        html, excerpt, length = preprocess_rich_text('<p>' + 'word ' * 100 + '</p>', 20)
+        self.assertEqual(len(excerpt), 20)
+        self.assertTrue(excerpt.endswith('…'))
+        self.assertEqual(length, len(('word ' * 100).strip()))
+
+    def test_empty(self):
+        self.assertEqual(preprocess_rich_text(None, 10), ('', '', 0))
@@ -0,0 +1,129 @@
+import ipaddress
+import time
+from itertools import islice
+
+from django.conf import settings
+from django.core.cache import cache
+from rest_framework.settings import api_settings
+from rest_framework.throttling import BaseThrottle
+
+from . import metrics
+from .service import get_client_ip
+
+DURATIONS = {'s': 1, 'm': 60, 'h': 3600, 'd': 86400}
+
+
+class TokenBucketThrottle(BaseThrottle):
+    """ Token bucket для throttle_scope вьюхи
+
+    Быстрый путь - ведро в памяти процесса без блокировок: пустое ведро отклоняет
+    запрос без обращения к кэшу и БД. Если локально токен есть, запрос
+    засчитывается в общем кэше, чтобы лимит соблюдался на все процессы.
+    Лимиты берутся из DEFAULT_THROTTLE_RATES по ключу '<scope>_<ident_name>'.
+    Запрос стоит view.get_throttle_cost(request) токенов (по умолчанию один).
+    """
+    ident_name = None
+    # {ключ: (токены, время обновления)} от давно не обновлявшихся к свежим;
+    # кортеж заменяется целиком, поэтому блокировка не нужна
+    buckets = {}
+
+    def __init__(self):
+        self.wait_seconds = None
+
+    def get_ident(self, request):
+        raise NotImplementedError('.get_ident() must be overridden')
+
+    def get_rate(self, view):
+        scope = getattr(view, 'throttle_scope', None)
+        rate = api_settings.DEFAULT_THROTTLE_RATES.get(f'{scope}_{self.ident_name}') if scope else None
+        if rate is None:
+            return None
+        num, period = rate.split('/')
+        return int(num), DURATIONS[period[0]]
+
+    def get_capacity(self, request, view):
+        """ Сколько токенов вмещает ведро клиента; None - лимит к запросу не применяется """
+        rate = self.get_rate(view)
+        if rate is None or self.get_ident(request) is None:
+            return None
+        return rate[0]
+
+    def allow_request(self, request, view):
+        rate = self.get_rate(view)
+        if rate is None:
+            return True
+        ident = self.get_ident(request)
+        if ident is None:
+            return True
+        capacity, duration = rate
+        cost = view.get_throttle_cost(request) if hasattr(view, 'get_throttle_cost') else 1
+        if cost > capacity:
+            # Такой запрос не пройдёт никогда, ждать бессмысленно
+            metrics.incr('throttle.rejected_cost')
+            return False
+        key = f'throttle:{view.throttle_scope}:{self.ident_name}:{ident}'
+
+        now = time.monotonic()
+        refill = capacity / duration
+        tokens, updated = self.buckets.get(key, (capacity, now))
+        tokens = min(capacity, tokens + (now - updated) * refill)
+        if tokens < cost:
+            self.buckets[key] = (tokens, now)
+            self.wait_seconds = (cost - tokens) / refill
+            metrics.incr('throttle.rejected_local')
+            return False
+        if len(self.buckets) >= settings.THROTTLE_MAX_BUCKETS:
+            self.evict()
+        # pop перед записью переносит ключ в конец: первыми вытесняются давно не обновлявшиеся
+        self.buckets.pop(key, None)
+        self.buckets[key] = (tokens - cost, now)
+
+        window = int(time.time() // duration)
+        shared_key = f'{key}:{window}'
+        cache.add(shared_key, 0, duration)
+        try:
+            count = cache.incr(shared_key, cost)
+        except ValueError:
+            count = cost
+        if count > capacity:
+            self.wait_seconds = duration - time.time() % duration
+            metrics.incr('throttle.rejected_shared')
+            return False
+        return True
+
+    def evict(self):
+        """ Убрать десятую часть ведер, которые дольше всех не обновлялись """
+        for key in list(islice(self.buckets, max(1, settings.THROTTLE_MAX_BUCKETS // 10))):
+            self.buckets.pop(key, None)
+        metrics.incr('throttle.evicted')
+
+    def wait(self):
+        return self.wait_seconds
+
+
+class IPTokenBucketThrottle(TokenBucketThrottle):
+    """ Лимит на IP клиента, для IPv6 - на сеть THROTTLE_IPV6_PREFIX """
+    ident_name = 'ip'
+
+    def get_ident(self, request):
+        ip = get_client_ip(request)
+        try:
+            address = ipaddress.ip_address(ip)
+        except ValueError:
+            return ip
+        if address.version == 4:
+            return ip
+        if address.ipv4_mapped:
+            return str(address.ipv4_mapped)
+        # Клиенту IPv6 обычно выдаётся целая /64: лимит на сеть, а не на адрес
+        return str(ipaddress.ip_network(f'{address}/{settings.THROTTLE_IPV6_PREFIX}', strict=False))
+
+
+class UserTokenBucketThrottle(TokenBucketThrottle):
+    """ Лимит на авторизованного пользователя """
+    ident_name = 'user'
+
+    def get_ident(self, request):
+        if request.user and request.user.is_authenticated:
+            return request.user.pk
+        return None
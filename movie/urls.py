@@ -6,11 +6,15 @@ from . import views
 
 urlpatterns = format_suffix_patterns([
     path("movie/", views.MovieViewSet.as_view({'get': 'list'})),
+    path("movie/facets/", views.MovieViewSet.as_view({'get': 'facets'})),
     path("movie/<int:pk>/", views.MovieViewSet.as_view({'get': 'retrieve'})),
     path("review/", views.ReviewCreateViewSet.as_view({'post': 'create'})),
+    path("review/batch/", views.ReviewBatchViewSet.as_view({'post': 'create'})),
     path("rating/", views.AddStarRatingViewSet.as_view({'post': 'create'})),
+    path("rating/batch/", views.RatingBatchViewSet.as_view({'post': 'create'})),
     path('actor/', views.ActorsViewSet.as_view({'get': 'list'})),
     path('actor/<int:pk>/', views.ActorsViewSet.as_view({'get': 'retrieve'})),
+    path('metrics/', views.MetricsView.as_view()),
 ])
 
 # urlpatterns = [
@@ -1,32 +1,41 @@
-from django.db import models
+from django.conf import settings
+from django.db import transaction
+from django.http import Http404
 from rest_framework.response import Response
 from rest_framework.views import APIView
-from rest_framework import generics, permissions, viewsets
+from rest_framework import generics, permissions, status, viewsets
 from django_filters.rest_framework import DjangoFilterBackend
+from drf_yasg.utils import swagger_auto_schema
 
+from . import metrics
+from .documents import absolute_media_urls, get_movie_document, invalidate_movie_documents
+from .events import publish_ratings, publish_reviews
+from .limits import LoadSheddingMixin
 from .models import Movie, Actor
 from .serializers import (
     MovieListSerializer,
     MovieDetailSerializer,
+    MovieFacetsSerializer,
     ReviewCreateSerializer,
     CreateRatingSerializer,
     ActorListSerializer, ActorDetailSerializer
 )
-from .service import get_client_ip, MovieFilter, PaginationMovies
+from .service import annotate_ratings, defer_descriptions, get_client_ip, get_voter_key, get_cached_movie_facets, MovieFilter, PaginationMovies
 
 
-class MovieViewSet(viewsets.ReadOnlyModelViewSet):
+class MovieViewSet(LoadSheddingMixin, viewsets.ReadOnlyModelViewSet):
     """Вывод списка фильмов"""
     filter_backends = (DjangoFilterBackend,)
     filterset_class = MovieFilter
     pagination_class = PaginationMovies
+    statement_timeout = 2000
+    query_budget = 15
+    degraded_actions = ('list', 'retrieve', 'facets')
+    degraded_params = ('genres', 'year_min', 'year_max', 'page', 'description')
 
     def get_queryset(self):
-        movies = Movie.objects.filter(draft=False).annotate(
-            rating_user=models.Count("ratings",
-                                     filter=models.Q(ratings__ip=get_client_ip(self.request)))
-        ).annotate(
-            middle_star=models.Sum(models.F('ratings__star')) / models.Count(models.F('ratings'))
+        movies = annotate_ratings(
+            defer_descriptions(Movie.objects.filter(draft=False)), get_voter_key(get_client_ip(self.request))
         )
         return movies
 
@@ -35,24 +44,111 @@ class MovieViewSet(viewsets.ReadOnlyModelViewSet):
             return MovieListSerializer
         elif self.action == "retrieve":
             return MovieDetailSerializer
+        elif self.action == 'facets':
+            return MovieFacetsSerializer
 
+    def retrieve(self, request, *args, **kwargs):
+        document = get_movie_document(kwargs['pk'])
+        if document is None:
+            raise Http404
+        if request.query_params.get('description') == 'excerpt':
+            # Только выдержка: полное описание может быть очень большим
+            document = {key: value for key, value in document.items() if key != 'description'}
+        return Response(absolute_media_urls(document, request))
 
-class ReviewCreateViewSet(viewsets.ModelViewSet):
+    @swagger_auto_schema(responses={200: MovieFacetsSerializer()})
+    def facets(self, request):
+        """Количество фильмов по жанрам, категориям и годам для текущих фильтров"""
+        queryset = self.filter_queryset(Movie.objects.filter(draft=False))
+        return Response(get_cached_movie_facets(queryset, request.query_params))
+
+    def get_degraded_data(self):
+        data = super().get_degraded_data()
+        if data is not None and self.action == 'list':
+            # rating_user в кэше относится к тому, чей ответ был сохранён
+            data = {**data, 'results': [{**movie, 'rating_user': None} for movie in data['results']]}
+        return data
+
+
+class ReviewCreateViewSet(LoadSheddingMixin, viewsets.ModelViewSet):
     """Добавление отзыва к фильму"""
     serializer_class = ReviewCreateSerializer
+    throttle_scope = 'review'
+    statement_timeout = 1000
+    query_budget = 10
 
 
-class AddStarRatingViewSet(viewsets.ModelViewSet):
+class AddStarRatingViewSet(LoadSheddingMixin, viewsets.ModelViewSet):
     """Добавление рейтинга фильму"""
     serializer_class = CreateRatingSerializer
+    throttle_scope = 'rating'
+    statement_timeout = 1000
+    query_budget = 15
 
     def perform_create(self, serializer):
-        serializer.save(ip=get_client_ip(self.request))
+        serializer.save(voter=get_voter_key(get_client_ip(self.request)))
+
+
+class BatchCreateMixin:
+    """Пакетная запись: массив объектов, результат или ошибки по каждому элементу"""
 
+    def get_batch_max_size(self, request):
+        """ BATCH_MAX_SIZE, но не больше ведра лимита клиента: больший пакет не прошёл бы никогда """
+        capacities = [throttle.get_capacity(request, self) for throttle in self.get_throttles()]
+        return min([settings.BATCH_MAX_SIZE] + [capacity for capacity in capacities if capacity is not None])
 
-class ActorsViewSet(viewsets.ReadOnlyModelViewSet):
+    def get_throttle_cost(self, request):
+        # Элемент пакета расходует лимит так же, как отдельный запрос; слишком большой
+        # пакет списывает ведро целиком и получает 400 с допустимым размером
+        if not isinstance(request.data, list):
+            return 1
+        return min(len(request.data), self.get_batch_max_size(request))
+
+    def create(self, request, *args, **kwargs):
+        serializer = self.get_serializer(data=request.data, many=True, max_length=self.get_batch_max_size(request))
+        serializer.is_valid(raise_exception=True)
+        if serializer.validated_data:
+            self.perform_create(serializer)
+        results = serializer.get_results()
+        metrics.incr(f'batch.{self.throttle_scope}.items', len(results))
+        metrics.incr(f'batch.{self.throttle_scope}.errors', len(serializer.item_errors))
+        if not serializer.item_errors:
+            code = status.HTTP_201_CREATED
+        elif serializer.validated_data:
+            code = status.HTTP_207_MULTI_STATUS
+        else:
+            code = status.HTTP_400_BAD_REQUEST
+        return Response({'results': results}, status=code)
+
+
+class ReviewBatchViewSet(BatchCreateMixin, ReviewCreateViewSet):
+    """Пакетное добавление отзывов"""
+    statement_timeout = 5000
+
+    def perform_create(self, serializer):
+        reviews = serializer.save()
+        movie_ids = {review.movie_id for review in reviews}
+        # Сигналы post_save при bulk_create не приходят: кэши обновляются один раз на пакет
+        invalidate_movie_documents(movie_ids)
+        transaction.on_commit(lambda: publish_reviews(reviews))
+
+
+class RatingBatchViewSet(BatchCreateMixin, AddStarRatingViewSet):
+    """Пакетное добавление рейтинга"""
+    statement_timeout = 5000
+
+    def perform_create(self, serializer):
+        ratings = serializer.save(voter=get_voter_key(get_client_ip(self.request)))
+        transaction.on_commit(lambda: publish_ratings(rating.movie_id for rating in ratings))
+
+
+class ActorsViewSet(LoadSheddingMixin, viewsets.ReadOnlyModelViewSet):
     """Вывод актеров или режиссеров"""
     queryset = Actor.objects.all()
+    statement_timeout = 1000
+    query_budget = 5
+    degraded_actions = ('list', 'retrieve')
+    degraded_params = ('limit', 'offset')
 
     def get_serializer_class(self):
         if self.action == 'list':
@@ -60,6 +156,14 @@ class ActorsViewSet(viewsets.ReadOnlyModelViewSet):
         elif self.action == "retrieve":
             return ActorDetailSerializer
 
+
+class MetricsView(APIView):
+    """Счётчики текущего процесса"""
+    permission_classes = [permissions.IsAdminUser]
+
+    def get(self, request):
+        return Response(metrics.snapshot())
+
 # class MovieListView(generics.ListAPIView):
 #     """ Вывод списка фильмов """
 #     serializer_class = MovieListSerializers
@@ -0,0 +1,94 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+from django.conf import settings
+from django.db import connection, models
+from django.http import QueryDict
+from django.utils import translation
+
+from .documents import rebuild_movie_documents
+from .models import Genre, Movie
+from .service import MovieFilter, get_cached_movie_facets, rating_totals
+
+
+def get_year_ranges():
+    bucket = settings.FACETS_YEAR_BUCKET
+    years = Movie.objects.filter(draft=False).aggregate(first=models.Min('year'), last=models.Max('year'))
+    if years['first'] is None:
+        return []
+    return [
+        {'year_min': start, 'year_max': start + bucket - 1}
+        for start in range(years['first'] // bucket * bucket, years['last'] + 1, bucket)
+    ]
+
+
+def get_filter_params():
+    """ Параметры фильтра: без фильтра, каждый жанр, каждый диапазон лет и их пары """
+    genres = [{'genres': title} for title in Genre.objects.values_list('title', flat=True)]
+    years = get_year_ranges()
+    combinations = [{}] + genres + years + [{**genre, **year} for genre in genres for year in years]
+    params = []
+    for combination in combinations:
+        query = QueryDict(mutable=True)
+        # Значения строками, как в request.query_params: от этого зависит ключ кэша фасетов
+        query.update({key: str(value) for key, value in combination.items()})
+        params.append(query)
+    return params
+
+
+def warm_up_facets(languages=None):
+    """ Фасеты для всех комбинаций фильтра на каждом языке, прямо в кэш, без HTTP; сколько наборов """
+    languages = languages or settings.WARMUP_LANGUAGES
+    params = get_filter_params()
+    for language in languages:
+        with translation.override(language):
+            for query in params:
+                queryset = MovieFilter(query, queryset=Movie.objects.filter(draft=False)).qs
+                get_cached_movie_facets(queryset, query)
+    return len(params) * len(languages)
+
+
+def get_top_movie_ids(limit):
+    """ Самые оцениваемые опубликованные фильмы, вместе со свёрнутыми голосами """
+    _, votes = rating_totals()
+    return list(
+        Movie.objects.filter(draft=False).annotate(votes=votes).filter(votes__gt=0)
+        .order_by('-votes').values_list('pk', flat=True)[:limit]
+    )
+
+
+def warm_up(urls, base_url, languages=None, concurrency=None):
+    """ Запросить URL на каждом языке не больше чем в concurrency потоков; [(url, язык, статус, секунды)] """
+    base_url = base_url.rstrip('/')
+    languages = languages or settings.WARMUP_LANGUAGES
+
+    def fetch(job):
+        url, language = job
+        started = time.monotonic()
+        try:
+            status = requests.get(
+                base_url + url, headers={'Accept-Language': language}, timeout=settings.WARMUP_TIMEOUT
+            ).status_code
+        except requests.RequestException as exc:
+            status = exc.__class__.__name__
+        return url, language, status, time.monotonic() - started
+
+    jobs = [(url, language) for language in languages for url in urls]
+    with ThreadPoolExecutor(max_workers=concurrency or settings.WARMUP_CONCURRENCY) as pool:
+        return list(pool.map(fetch, jobs))
+
+
+def warm_up_published(movie_ids):
+    """ После публикации: документы фильмов и фасеты (версия фасетов сброшена), в фоне """
+    movie_ids = list(movie_ids)
+
+    def run():
+        try:
+            rebuild_movie_documents(movie_ids)
+            warm_up_facets()
+        finally:
+            connection.close()
+
+    threading.Thread(target=run, daemon=True).start()